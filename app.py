@@ -1,15 +1,15 @@
-import os
-import base64
-import requests
-import json
 import io
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from PIL import Image, ExifTags
-import math
-
-# Environment Variables
-openai_api_key = os.environ.get("OPENAI_API_KEY")
-vehicle_data_api_key = os.environ.get("VEHICLE_DATA_API_KEY")
+import backends
+import checkpoints
+import ingest
+import pipeline
+import profiling
+import repair_model
+import triage
 
 # Streamlit Configuration
 st.set_page_config(
@@ -44,892 +44,388 @@ def set_example_values():
     st.session_state['FNOL_description'] = example_FNOL_description
     st.session_state['example_images'] = example_images
 
-def correct_image_orientation(image):
-    try:
-        for orientation in ExifTags.TAGS.keys():
-            if ExifTags.TAGS[orientation] == 'Orientation':
-                break
-        exif = dict(image._getexif().items())
-
-        if exif[orientation] == 3:
-            image = image.rotate(180, expand=True)
-        elif exif[orientation] == 6:
-            image = image.rotate(270, expand=True)
-        elif exif[orientation] == 8:
-            image = image.rotate(90, expand=True)
-    except (AttributeError, KeyError, IndexError):
-        # Cases: image doesn't have getexif
-        pass
-    return image
-
-
-
-# Streamlit Page
-def display_page():
-
-    st.sidebar.header('Vehicle Damage Upload')
-
-    # Add an example button in the sidebar
-    if st.sidebar.button('Load Example'):
-        set_example_values()
-
-    # Vehicle information input
-    vehicle_reg = st.sidebar.text_input("Vehicle Registration Number", value=st.session_state.get('vehicle_reg', ''))
-    FNOL_description = st.sidebar.text_area("First Notification of Loss Description", value=st.session_state.get('FNOL_description', ''))
-
-    # Image upload
-    uploaded_images = st.sidebar.file_uploader("Upload Damage Images", accept_multiple_files=True, type=['png', 'jpg', 'jpeg'], key="uploaded_images")
-
-    if uploaded_images:
-        st.session_state['user_images'] = uploaded_images  # Store user-uploaded images in session state
-
-    # Display images (user-uploaded or example)
-    images = st.session_state.get('user_images', []) or st.session_state.get('example_images', [])
-    for img_file in images:
-        image = Image.open(img_file)
-        corrected_image = correct_image_orientation(image)
-        st.sidebar.image(corrected_image, caption='Uploaded Image', use_container_width=True)
-
-    # Process images button
-    if st.sidebar.button("Process Images"):
-        if images and vehicle_reg and FNOL_description:
-
-            # Replacement costs used to approximate repair costs, ideally we would use an API connection with parts suppliers
-            replacement_costs = {
-                'Side Mirror': 300,
-                'Bonnet': 1000,
-                'Door Glass': 200,
-                'Door Handle': 200,
-                'Exhaust': 500,
-                'Front Bumper': 600,
-                'Front Door': 800,
-                'Headlamp': 400,
-                'Lower Grille': 150,
-                'Number Plate': 20,
-                'PDC Sensor': 150,
-                'Quarter Panel': 1500,
-                'Rear Bumper': 500,
-                'Rear Door': 800,
-                'Rear Emblem': 50,
-                'Rear Glass': 300,
-                'Rear Inner Lamp': 150,
-                'Rear Outer Lamp': 200,
-                'Rear Reflector': 50,
-                'Sill Panel': 600,
-                'Tailgate': 800,
-                'Tailgate Spoiler': 200,
-                'Third Brake Light': 100,
-                'Tow Eye Cap': 30,
-                'Upper Grille': 200,
-                'Wheel': 200,
-                'Tyre': 150,
-                'Windshield': 400,
-                'Wing': 300,
-                'Airbag': 2000,
-                'radiator support': 1000,
-                'condenser': 500,
-                'radiatior': 500,
-                'wheel alignment': 100,
-                'road test': 100,
-                'diagnostic trouble code': 100,
-            }
-
-            # Used for the one-shot prompt to GPT-4 for repair plan creation
-            json_example = """
-            Note: Before assessing damage from images, it's essential to distinguish between a vehicle's original body lines and damage-induced irregularities. Shadows and reflections can be deceptive and may not necessarily indicate damage. Knowing the vehicle's design is key to not mistaking design features for dents or creases. Always compare with the vehicle's standard lines to avoid misinterpretation caused by image lighting and angle effects. Normal gaps between panels must also be considered, as they may appear misaligned or damaged to the untrained eye.
-            Note: Minor damage, repairable within an hour, is often indicated by light scratches or small dents where the panel's reflective quality remains uniform, and there are no alterations in panel gaps or paint texture. Damage requiring between 2-3 hours to repair can vary, but here are some things to look out for: Dents or creases where the shadows and usual contours of the panel are disrupted. "Spider-webbing" where the impact causes the paint to crack (more common on plastic parts like bumpers). Deeper scratches or scrapes where paint may be visibly missing. These damages might be repairable depending on the repair limits for the damaged panel. Repair work extending to 4-6 hours typically involves significant deformation of the panel with highly visible creases and distortion in reflections, along with paint that is visibly cracked or flaked. It is extremely important to observe the overall vehicle since what might appear to be distortion from damage may just be the body lines of the vehicle. Extensive damage that exceeds 6 hours is characterized by substantial panel gaps misalignment, severe creasing and deformation of the panel, and extensive areas of compromised paint, suggesting the need for complex structural repairs or complete panel replacement.
-            Note: Be sure to examine the surrounding in the images, some objects may cause irregular reflections that can fool an unwary estimator.
-            {
-                // "reg_no" is the vehicle registration number. Leave it as an empty string if not available.
-                "reg_no": "GJ14WKH",
-
-                // "damage_description" describes the visible damage in the images and the repair plan.
-                "damage_description": "The images show a VW Golf that has been damaged in the front. The hood has been pushed back into the vehicle and is severely damaged with massive creases and severe misalignment, well beyond reasonable repair limits. Due to this severe damage the hood hinges and lacth must be replaced. The right headlamp is damaged and has a cracked lens. The impact has shoved the right headlamp into the right fender, so repair and painting will be required. The front grille is missing and will require replacement. No damage is visible to the right or left fenders and wheels. The front bumper has been damaged and is not sitting correctly, it also has various deep scratches and cracks. The overall repair plan will be as follows: Replace front bumper, replace hood, replace right headlamp, replace the front grille, replace hood hinges, replace hood latch, and repair the right fender. The shop must also check the radiator support, condenser, radiator, LH headlamp, lower bumper grilles, and LH fender for damage.",
-
-                // "parts_list" is an array where each object represents a car part needing attention. This means the part requires replacement, repair, or painting depending on the severity of the damage.
-                // Each object can contain the following fields:
-                // - "part": Name or type of the part (e.g. "Bumper", "Hood", "Headlamp", "Fender", "Fog Lamp Grille", "Tow Eye Cap", "Wheel", "Tyre", "Suspension Components", etc.)
-                // - "position": Location on the vehicle, if applicable. ("LH", "RH", "FRONT", "REAR", "LF", "RF", "LR", or "RR" are the valid options.) This field must always be present, even if empty.
-                // - "s_r": A boolean indicating whether the part should be stripped and refitted (true/false).
-                // - "repair": A boolean indicating if the part should be repaired (true/false). (CANNOT BE USED WITH "replace") Only select true if damage is visible and without question. 
-                // - "replace": A boolean indicating if the part should be replaced (true/false). (CANNOT BE USED WITH "repair") Only select true if damage is visible and without question. Non-painted parts like tyres, wheels, and headlamps must be replaced if clearly damaged.
-                // - "paint": A boolean indicating if the part needs painting after repair or replacement (true/false).
-                // Note: "repair" and "replace" are mutually exclusive. When determining whether to repair or replace a part, consider the cost of the part, the cost of labour, and the time required to repair the part.
-                // Approximate repair limits for parts: Bumper (1 hour), Mouldings (.5 hours), Fender (1 hour), Hood (6 hours), Tailgate (4 hours), Doors (5 hours), Quarter Panels (8 hours), Sill Panels (6 hours)
-                // Note: We do not perform paintless dent repair of any type. All damage must be repaired using traditional methods.
-                
-                "parts_list": [
-                    {
-                        "part": "Bumper",
-                        "position": "FRONT",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not cost effective, damage would exceed 1 hour of repair time
-                        "replace": true, // Replacement is required due to the bumper being broken misaligned. Bumpers are low cost parts and are usually replaced if damage exceeds an couple hours of repair time.
-                        "paint": true // Painting is required
-                    },
-                    {
-                        "part": "Hood",
-                        "position": "",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not possible, damage would exceed 6 hours of repair time
-                        "replace": true, // Replacement is required due to severe damage.
-                        "paint": true // Painting is required
-                    },
-                    {
-                        "part": "Headlamp",
-                        "position": "RH",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not required
-                        "replace": true, // Replacement is required due to cracked lens and broken mounting points. 
-                        "paint": false // Painting is not required
-                    },
-                    {
-                        "part": "Grille",
-                        "position": "FRONT",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not required
-                        "replace": true, // Replacement is required since the grille is broken off and missing.
-                        "paint": false // Painting is not required
-                    },
-                    {
-                        "part": "Hood Hinges",
-                        "position": "",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not required
-                        "replace": true, // Replacement is required hood has been shoved far back into the vehicle.
-                        "paint": true // Painting is  required
-                    },
-                    {
-                        "part": "Hood Latch",
-                        "position": "",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": false, // Repair is not required
-                        "replace": true, // Replacement is required hood has been shoved far back into the vehicle.
-                        "paint": false // Painting is not required
-                    },
-                    {
-                        "part": "Fender",
-                        "position": "RH",
-                        "s_r": true, // Strip and Refit is required
-                        "repair": true, // Repair is required since headlamp has been shoved into the fender and has caused minor damage.
-                        "replace": false, // Replacement is not required
-                        "paint": true // Painting is required
-                    }
-                    // More parts can be added with the same structure.
-                ],
-
-                // "new_parts_info" contains verbatim comments or special instructions 
-                // related to new parts needed for the repair job. Include hidden parts (like "Tailgate Latch", "Bumper Absorber", "Bumper Bracket", "Impact Bar", etc.) if they are needed for the repair.
-                // Don't forget to include safety critical parts like airbags, seat belts, and suspension components if they are damaged.
-                "new_parts_info": "Front Bumper, Hood, RH Headlamp, Front Grille, Hood Hinges, Hood Latch",
-
-                // "specialist_work_required" is an object containing various specialist operations
-                // required for the job with boolean indicators (true/false):
-                // - "first_dtc": Need for the first Diagnostic Trouble Code.
-                // - "wheel_alignment": Requirement for wheel alignment to check and adjust the suspension geometry if needed.
-                // - "road_test": Necessity of a road test to ensure vehicle safety and function.
-                // - "final_dtc": Requirement for the final Diagnostic Trouble Code after repairs.
-                // - "new_part_coding": The need to code new parts into the vehicle's electronic systems, rare for most vehicles.
-                // - "air_con": Requirement for servicing the air conditioning system.
-                // - "glass_removal": Specialist cleaning of shattered glass from the vehicle's interior.
-                // - "adas_calibration": Calibration of Advanced Driver Assistance Systems. This will be evaluated later by a human who is qualified.
-                "specialist_work_required": {
-                    "first_dtc": true, // A Pre-scan of the vehicle's DTCs is required (always true)
-                    "wheel_alignment": false, // A four wheel alignment is not required. (select true when suspension, steering, or drivetrain components are or might be damaged.)
-                    "road_test": true, // Road test is required (select true when suspension, steering, or drivetrain components are damaged. Also select true if the vehicle has damage that may have affected the engine, transmission, ADAS functions, etc.)
-                    "final_dtc": true, // A Post-scan of the vehicle's DTCs is required (always true)
-                    "new_part_coding": false, // New part coding is not required
-                    "air_con": false, // Air conditioning service is not required
-                    "glass_removal": false, // Glass removal is not required
-                    "adas_calibration": false // ADAS calibration is not required
-                },
-
-                // "wheels_removed_for_repair" is an object indicating whether each wheel (by position) must be removed for the repair process.
-                "wheels_removed_for_repair": {
-                    "LF": false, // Removal of Left Front wheel is not required
-                    "RF": true, // Removal of Right Front wheel is required
-                    "LR": false, // Removal of Left Rear wheel is not required
-                    "RR": false  // Removal of Right Rear wheel is not required
-                },
-
-                // "smart_repairs_required" is a string field for additional instructions or descriptions of additional suggestions or information for the repair, such as checking if mounting brackets are damaged, consulting the repair methods to determine if a panel is made out of UHSS, checking if any ADAS sensors are damaged, etc.
-                "smart_repairs_required": "Check Radiator Support, Condenser, Radiator, LH Headlamp, and LH fender for damage."
-            }
-
-            """
-
-            # Function to encode images to base64 for GPT-4-Vision
-            def encode_image(image_input):
-                # Check if the input is a file path (string) and the file exists
-                if isinstance(image_input, str) and os.path.isfile(image_input):
-                    with open(image_input, "rb") as image_file:
-                        image = Image.open(image_file)
-                        return _encode_image_as_jpeg(image)
-            
-                # Check if the input is a Streamlit UploadedFile object
-                elif hasattr(image_input, 'getvalue'):  # Check if it's a BytesIO instance from an uploaded file
-                    image = Image.open(io.BytesIO(image_input.getvalue()))
-                    return _encode_image_as_jpeg(image)
-            
-                # Check if the input is a PIL Image object
-                elif isinstance(image_input, Image.Image):
-                    return _encode_image_as_jpeg(image_input)
-            
-                else:
-                    raise ValueError("Unsupported input type for image encoding")
-            
-            # Helper function to encode a PIL Image as JPEG and return a base64 string
-            def _encode_image_as_jpeg(image):
-                buffered = io.BytesIO()
-                # Ensure the image is in RGB format before saving as JPEG
-                image = image.convert('RGB')
-                image.save(buffered, format="JPEG")
-                return base64.b64encode(buffered.getvalue()).decode('utf-8')
-                
-            # Function to scale the costs based on the TradeRetail value, ideally we would use an API connection with parts suppliers
-            def scale_costs(trade_retail_value, replacement_costs, scaling_base=4000, slow_scale_factor=0.02):
-                trade_retail_value = float(trade_retail_value)  # Convert TradeRetail value to a number
-
-                if trade_retail_value > scaling_base:
-                    # Apply a very slow scaling using a square root function
-                    # The slow_scale_factor is used to control the rate of scaling further
-                    excess_value = trade_retail_value - scaling_base
-                    scale_factor = 1 + (slow_scale_factor * math.sqrt(excess_value))
-                else:
-                    scale_factor = 1  # No scaling if TradeRetail value is £4000 or less
-
-                scaled_costs = {item: cost * scale_factor for item, cost in replacement_costs.items()}
-                return scaled_costs
-
-            # Function to fetch data (mocked with given API responses)
-            def fetch_and_save_data(VRM, DataPackage):
-                if DataPackage == "ValuationData":
-                    # Pre-loaded response for ValuationData
-                    return {
-                        "TradeRetail": 11210,
-                        "StatusCode": "Success",
-                        "Mileage": "82,225",
-                        "PlateYear": "2017-17",
-                        "VehicleDescription": "BMW 320D SPORT GT AUTO"
-                    }
-                elif DataPackage == "VehicleData":
-                    # Pre-loaded response for VehicleData
-                    return {
-                        "StatusCode": "Success",
-                        "NumberOfDoors": 5,
-                        "KerbWeight": 1595,
-                        "Model": "320D SPORT GT AUTO",
-                        "Make": "BMW",
-                        "IsElectricVehicle": False,
-                        "YearOfManufacture": "2017",
-                        "Transmission": "AUTO 8 GEARS",
-                        "FuelType": "DIESEL",
-                        "BodyStyle": "Hatchback"
-                    }
-                else:
-                    return None
-
-            # Function to send images to GPT-4-Vision
-            def send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key):
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {openai_api_key}"
-                }
-
-                messages = [
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": []
-                    }
-                ]
-
-                if "[EXAMPLE_IMAGES_PLACEHOLDER]" in user_prompt:
-                    # Split the user_prompt into two parts
-                    prompt_parts = user_prompt.split("[EXAMPLE_IMAGES_PLACEHOLDER]")
-                    messages[-1]["content"].append({
-                        "type": "text",
-                        "text": prompt_parts[0].strip()
-                    })
-
-                    # Encode example images
-                    for image in example_images:
-                        base64_example_image = encode_image(image)
-                        messages[-1]["content"].append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_example_image}"
-                            }
-                        })
-
-                    messages[-1]["content"].append({
-                        "type": "text",
-                        "text": prompt_parts[1].strip()
-                    })
-                else:
-                    messages[-1]["content"].append({
-                        "type": "text",
-                        "text": user_prompt
-                    })
-
-                # Encode actual images
-                for image in images:
-                    base64_actual_image = encode_image(image)
-                    messages[-1]["content"].append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_actual_image}"
-                        }
-                    })
-
-                payload = {
-                    "model": "gpt-4o",
-                    "messages": messages,
-                    "max_tokens": 4000,
-                    "temperature": 0
-                }
-
-                response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=payload)
-
-                if response.status_code == 200:
-                    return response.json()['choices'][0]['message']['content']
-                else:
-                    print("Failed to process the images")
-                    return {"error": f"Request failed with status code {response.status_code}"}
-
-
-
-            # Function for natural language prompts only, can use GPT-3.5 or GPT-4
-            def gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key):
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {openai_api_key}"
-                }
-
-                payload = {
-                    "model": f"{model}",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": user_prompt}
-                            ]
-                        }
-                    ],
-                    "max_tokens": 1000,
-                    "temperature" : 0
-                }
-
-                response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=payload)
-                
-                if response.status_code == 200:
-                    return response.json()['choices'][0]['message']['content']
-                else:
-                    print("Failed to process the image")
-                    return {"error": f"Request failed with status code {response.status_code}"}
-
-
-            with st.spinner('Fetching Vehicle Valuation...'):
-                valuation_data_response = fetch_and_save_data(vehicle_reg, "ValuationData")
-
-                trade_retail = valuation_data_response["TradeRetail"]
-                scaled_costs = scale_costs(trade_retail, replacement_costs)
-                print(scaled_costs)
-
-
-
-            # For gathering VehicleData
-            with st.spinner('Fetching Vehicle Data...'):
-                Car_data_response = fetch_and_save_data(vehicle_reg, "VehicleData")
-            print(Car_data_response)
-
-            make_model = Car_data_response["Make"] + " " + Car_data_response["Model"]
-            st.write(f"Vehicle Identified from Database: {make_model}")
-            
-            st.write(f"Pre-Accident Value: £{trade_retail}")
-            st.write("")
-
-            example_images = ""
-
-
-
-            #Time for the cool stuff!
-
-
-            #First we need to determine the damage location
-            system_prompt = f"""You are assisting and Accident Repair group by identifying the damage location on vehicles.
-            You will be shown various images of a {make_model}, you must determine whether the overall damage is located at the front or rear of the vehicle.
-
-            Provide your output as either "Front" or "Rear" with no other text. Provide only one output for the overall vehicle/damages.
-            """
-
-            user_prompt = "Identify the location of the damage on the vehicle from the options provided."
-            example_images = ""
-
-
-            with st.spinner('Determining Damage Location in Images...'):
-                front_rear = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                print(front_rear)
-
-
-
-                system_prompt = f"""You are assisting and Accident Repair group by identifying the damage location on vehicles.
-                You will be shown images of a {make_model}, and you must choose which of the following best describes the location of the damage on the vehicle: Right Front, Left Front, Right Rear, Left Rear, Front, Rear, Right, Left
-
-                Your output should be only one of the options from the list above. Provide that and no other text.
-                """
-
-                user_prompt = "Identify the location of the damage on the vehicle from the options provided."
-
-                print("Now to determine the location")
-                damage_location_part1 = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                print(damage_location_part1)
-
-
-                #Turning GPT-4 weakness into a strength! Its terrible at lefts and right so I just let it do its thing and use some logic to correct if needed
-                if front_rear == "Front":
-                    system_prompt = f"""You are assisting and Accident Repair group by identifying the damage location on vehicles.
-                    You will be shown various images of a {make_model}, you must determine if images exist for both the front and rear of the vehicle.
-
-                    Provide your output as either "Yes" or "No" with no other text. Provide only one output that accounts for all the images.
-                    """
-
-                    user_prompt = "Identify the location of the damage on the vehicle from the options provided."
-                    example_images = ""
-
-                    front_and_rear = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-
-                    if front_and_rear == "No":
-                        system_prompt = "You are assisting with some data cleaning for a researcher. You must switch 'Left' to 'Right' and vice versa if the damage_location_part1 value the user provides you is 'Front'. Otherwise, output the damage location unchanged. Provide only one output for the overall vehicle/damages. If the damage_location_part1 is only Front or Rear, output the damage_location_part1 unchanged."
-                        user_prompt = f"Here is the front_rear value: {front_rear}. Here is the damage_location_part1 value: {damage_location_part1}. Provide the output based on the rules you've been provided."
-
-                        print("now to determine the correct location based on industry standards")
-                        model = "gpt-3.5-turbo-0125"
-                        damage_location = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                        
-                        st.write("Damage Location in Images: ", damage_location)
-                        st.write("")
-                    else:
-                        st.write(f"Damage Location in Images: {damage_location_part1}")
-                        st.write("")
-                        damage_location = damage_location_part1
-                else:
-                    st.write(f"Damage Location in Images: {damage_location_part1}")
-                    st.write("")
-                    damage_location = damage_location_part1
-
-
-
-
-            #Now that we know where the damage is in the photos we need to compare it to the claim and vehicle details to check for fraud
-
-            example_images = ""
-
-            system_prompt = f"""You are assisting and Accident Repair group and insurance company by doing some basic fraud checks.
-            Start with Fraud detection/confirmation that the vehicle seems to be a {make_model}.
-            Next check that the images are not of a computer screen, a printed image, or contain any watermarks.
-            Finally you must compare the damage location provided in the FNOL with the damage location identified by another expert.
-            If anything indicates this might be fraudulent (or if the vehicle does not seem to be assessable given the images) the process should stop and the recommendation should be to escalate this to a senior.
-
-            Provide your output as JSON in the following format, with the fraudulent key set to True or False:
-            {{"fraudulent": False, "Description": "The images are of the correct vehicle and do not contain any watermarks or signs of tampering."}}
-
-            This will all be evaluated by a human, so if you are unsure, please flag it as potentially fraudulent.
-            """
-            user_prompt = f"Examine the images closely and provide your outputs as JSON. Here is the FNOL description: {FNOL_description}, and the damage location identified by another expert is {damage_location}"
-
-
-            with st.spinner('Checking for Fraudulent Activity...'):
-                response = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-
-                system_prompt = "You must parse the input you are provided and return valid json with no backticks or markdown."
-                user_prompt = f"Provide the raw json for the following: {response}"
 
-                model = "gpt-3.5-turbo-0125"
-                good_json = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                
+# Stages up to the repair plan run as soon as the claim is processed, the ones after it only
+# when the assessor asks for them (or in the background when prefetching is switched on)
+LAZY_STAGES = ("cost", "drivability", "triage")
+
+
+# Background workers for prefetching, shared by every session on this instance
+@st.cache_resource
+def prefetch_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+
+# Everything computed for a claim is checkpointed under its claim ID and FNOL and held in the session,
+# so reruns and re-processing the same claim reuse the stages already done
+def get_assessment(claim_id, vehicle_reg, FNOL_description, images):
+    assessments = st.session_state.setdefault('assessments', {})
+    key = pipeline.checkpoint_key(claim_id, FNOL_description)
+    # A claim that got through every stage is assessed afresh when it's processed again
+    if key not in assessments or assessments[key]["checkpoints"].finished:
+        assessments[key] = {
+            "key": key,
+            "claim_id": claim_id,
+            "vehicle_reg": vehicle_reg,
+            "FNOL_description": FNOL_description,
+            "images": images,
+            "checkpoints": checkpoints.ClaimCheckpoints(key),
+            "served_by": [],
+            "prefetch": {},
+            "prefetched": False,
+            "errors": {},
+            "failed": None,
+        }
+    return assessments[key]
+
+
+# Run a stage unless the claim already has its result
+def run_stage(assessment, stage, label, compute, load=None):
+    claim = assessment["checkpoints"]
+    if stage in claim:
+        return claim.run(stage, compute, load)
+
+    # A failed stage is only retried when the claim is processed again, not on every rerun
+    if assessment["failed"] is not None:
+        raise assessment["failed"]
+    with st.spinner(label):
+        try:
+            return claim.run(stage, compute, load)
+        except checkpoints.StageFailed as e:
+            assessment["failed"] = e
+            raise
+
+
+def compute_cost(assessment):
+    return pipeline.calculate_repair_cost(assessment["plan"], assessment["scaled_costs"])
+
+
+def compute_drivability(assessment):
+    return pipeline.assess_drivability(assessment["images"], assessment["make_model"], assessment["plan"], assessment["FNOL_description"])
+
+
+def compute_triage(assessment, cleaned_cost):
+    return pipeline.triage_vehicle(
+        assessment["images"], assessment["plan"], assessment["make_model"],
+        assessment["FNOL_description"], cleaned_cost, assessment["trade_retail"], assessment["Car_data_response"]
+    )
+
+
+def run_lazy_stage(assessment, stage):
+    if stage == "cost":
+        compute = lambda: compute_cost(assessment)
+    elif stage == "drivability":
+        compute = lambda: compute_drivability(assessment)
+    else:
+        # Settle the cost first so its model calls aren't counted as part of triage
+        cleaned_cost = resolve_lazy_stage(assessment, "cost")
+        compute = lambda: compute_triage(assessment, cleaned_cost)
+    return assessment["checkpoints"].run(stage, compute)
+
+
+# A prefetch is held to a budget of its own, started when it starts running
+def prefetch_lazy_stage(assessment, stage):
+    with backends.claim_deadline():
+        return run_lazy_stage(assessment, stage)
+
+
+# Result of a lazy stage: waits for a prefetch already under way, otherwise computes it here
+def resolve_lazy_stage(assessment, stage):
+    future = assessment["prefetch"].get(stage)
+    if stage not in assessment["checkpoints"] and future is not None:
+        return future.result()
+    return run_lazy_stage(assessment, stage)
+
+
+# Start the lazy stages on the shared executor, once each time the claim is processed. Each task
+# runs in a copy of the current context so its model calls are recorded against the claim.
+# The cost task is queued before triage, so triage never waits on a task that hasn't started.
+def prefetch_lazy_stages(assessment):
+    executor = prefetch_executor()
+    assessment["prefetched"] = True
+    for stage in LAZY_STAGES:
+        if stage not in assessment["checkpoints"] and stage not in assessment["prefetch"]:
+            assessment["prefetch"][stage] = executor.submit(contextvars.copy_context().run, prefetch_lazy_stage, assessment, stage)
+
+
+def show_cost(cleaned_cost):
+    st.write(f"The cost of the repair is: £{cleaned_cost}")
+    st.write("")
+
+
+def show_drivability(drivability):
+    if drivability["error"]:
+        st.write(drivability["error"])
+    elif drivability["result"].get('drivable', False):
+        st.write("✅ The vehicle is safe to drive.")
+    else:
+        st.write("❌ The vehicle is not safe to drive.")
+        st.write(drivability["result"]['reason'])
+
+    st.write("")
+
+
+def show_triage(triage_outcome):
+    triage_decision = triage_outcome["decision"]
+
+    # Check the decision and display the appropriate message
+    if triage_decision == triage.HUB_SITE or triage_decision == triage.SPOKE_SITE:
+        st.write(f"✅ This vehicle should go to a {triage_decision}")
+    elif triage_decision == triage.TOTAL_LOSS:
+        st.write(f"⚠️ This vehicle should be escalated to a {triage_decision} assessment")
+    else:
+        print("Invalid decision or decision not found in response.")
+
+    st.write(triage_outcome["summary"])
+    st.write("")
 
-                # Check if good_json is not None and is a non-empty string
-                if good_json:
-                    try:
-                        # Parse the JSON string into a Python dictionary
-                        parsed_json = json.loads(good_json)
-                        
 
-                        # Now you can check if 'fraudulent' is True (Python's False since it's 'false' in the JSON) and print the description
-                        if parsed_json.get('fraudulent', False):
-                            st.write(f"⚠️ Fraud detected: {parsed_json['Description']}")
-                        else:
-                            st.write("✅ No fraud detected")
-                            
-                    except json.JSONDecodeError as e:
-                        st.write(f"Failed to decode JSON: {e}")
-                else:
-                    st.write("Failed to get a valid response or good_json is None or an empty string")
+# A lazy stage shows its result once there is one, otherwise a button to compute it.
+# A failure, including running out of budget, only affects its own section, the button stays to retry it.
+def render_lazy_stage(assessment, stage, button_label, spinner_label, show):
+    claim = assessment["checkpoints"]
+    future = assessment["prefetch"].get(stage)
+    if stage not in claim and future is not None and future.done():
+        try:
+            future.result()
+        except (checkpoints.StageFailed, backends.DeadlineExceeded) as e:
+            assessment["errors"][stage] = str(e)
+            del assessment["prefetch"][stage]
+            future = None
+
+    if stage in claim:
+        show(claim.run(stage, None))
+        return
 
+    if stage in assessment["errors"]:
+        st.error(assessment["errors"][stage])
+    if st.button(button_label, key=f"{stage}-{assessment['key']}"):
+        with st.spinner(spinner_label):
+            # Each click gets a budget of its own, however long the job card was read for first
+            try:
+                with backends.claim_deadline():
+                    resolve_lazy_stage(assessment, stage)
+                assessment["errors"].pop(stage, None)
+            except (checkpoints.StageFailed, backends.DeadlineExceeded) as e:
+                assessment["errors"][stage] = str(e)
+        # Rerun so anything computed along the way (the cost, for triage) shows in its own section
+        st.rerun()
+    elif future is not None:
+        st.caption("Prefetching in the background...")
+
+
+def render_assessment(assessment, prefetch):
+    claim_id = assessment["claim_id"]
+    vehicle_reg = assessment["vehicle_reg"]
+    FNOL_description = assessment["FNOL_description"]
+    images = assessment["images"]
+    started = time.perf_counter()
 
+    trade_retail, scaled_costs = run_stage(assessment, "valuation", 'Fetching Vehicle Valuation...', lambda: pipeline.fetch_valuation(vehicle_reg))
+    assessment["trade_retail"], assessment["scaled_costs"] = trade_retail, scaled_costs
+
+    # For gathering VehicleData
+    Car_data_response, make_model = run_stage(assessment, "vehicle_data", 'Fetching Vehicle Data...', lambda: pipeline.fetch_vehicle_data(vehicle_reg))
+    assessment["Car_data_response"], assessment["make_model"] = Car_data_response, make_model
 
-            #Fraud checks are all done, now we need to create the repair plan
+    st.write(f"Claim ID: {claim_id}")
+    st.write(f"Vehicle Identified from Database: {make_model}")
+
+    st.write(f"Pre-Accident Value: £{trade_retail}")
+    st.write("")
 
 
-            formatted_context = f"""
-                        "Here is some additional information about this vehicle/claim:\n"
-                        {FNOL_description}\n
-                        "It is vital that you consider this information when creating your repair plan. Keep in mind that this may not be all the information you need to create a repair plan, so examine the images carefully."
-                    """
 
-            system_prompt = """
-            You are an expert vehicle damage assessor working with team members at Halo ARC Ltd to create a repair plan for a vehicle that has been involved in an accident.
-            You will be given three images and a sample repair plan for a VW Golf, use this as a guide when creating your own.
-            The goal is to create an initial repair plan meeting BS 10125 Standards that can be used to order parts and set the site up for the repair. This is just a test, and will be evaluated by a human who is qualified.
-            Your repair plan will be graded on the following categories:
-            Description accuracy - How in-depth and accurate you describe the damage in the images. Points are deducted if you fail to include visible damage, even if the component only requires further inspection.
-            Collision Repair standards - How well you abide by industry standards and regulation (BS 10125) when creating the repair plan. Failure to include safety critical operations will result in a loss of points.
-            Repair Versus Replace Accuracy - Points will be deducted from this if you choose to repair a panel above the repair threshold. They are also deducted if you replace a panel for no reason, but this is less severe.
-            Special Considerations - You can gain points here by providing appropriate insights and reccomendations specific to the repair for the body shop to consider.
+    #Time for the cool stuff!
+
+    damage_location = run_stage(assessment, "location", 'Determining Damage Location in Images...', lambda: pipeline.determine_damage_location(images, make_model))
+    st.write(f"Damage Location in Images: {damage_location}")
+    st.write("")
 
-            You will get a tip based on your performance (up to $200) so take your time and think through the different steps methodically.
-            Your output must be in the structured JSON format.
-            """
-
-            user_prompt = f"""
-            I am a qualified vehicle damage assessor and I will be evaluating your repair plan before it is used in any real-world scenarios.
-            Below is an example of the JSON format to follow, this example has been created from the VW Golf in the first three images you will be shown.
 
-            [EXAMPLE_IMAGES_PLACEHOLDER]
+    fraud = run_stage(assessment, "fraud", 'Checking for Fraudulent Activity...', lambda: pipeline.check_fraud(claim_id, vehicle_reg, images, make_model, FNOL_description, damage_location))
 
-            {json_example}
+    for match in fraud["prescreen"]["matches"]:
+        vehicle = " for this vehicle" if match["same_vehicle"] else ""
+        st.write(f"⚠️ {match['image']} matches {match['image_name']} on claim {match['claim_id']}{vehicle} (distance {match['distance']})")
+    for finding in fraud["prescreen"]["findings"]:
+        st.write(f"⚠️ {finding}")
 
-            Your task is to create a repair plan for the next vehicle you will be shown.
-            {formatted_context}
-            Focus on damage you can clearly see. Explain what you see and lay out your plan in the "damage_description" field. This entry in the JSON job card is there for you to show your work, so be as detailed as possible.
-            Any missed items or operations will be deducted from your score, as will any unnecessary items. Use your understanding of current repair standards to guide you.
-            Remember, you lose more points for including unnecessary or incorrect items than you do for missing items. You are also penalized if you choose to replace a part that can be repaired.
-            Respond with only the structured JSON repair plan and nothing else.
+    if fraud["error"]:
+        st.write(fraud["error"])
+    elif fraud["result"].get('fraudulent', False):
+        st.write(f"⚠️ Fraud detected: {fraud['result']['Description']}")
+    else:
+        st.write("✅ No fraud detected")
 
-            [ACTUAL_IMAGES_PLACEHOLDER]
-            """
 
-            example_images = ["GOLF (1).jpg", "GOLF (4).jpg", "GOLF (7).jpg"]  # List of image file paths
+    # Checkpointed in its compact form, the lazy stages get the model built back from it
+    assessment["plan"] = run_stage(
+        assessment, "repair_plan", 'Creating Repair Plan...',
+        lambda: pipeline.create_repair_plan(images, FNOL_description).to_base64(), repair_model.RepairPlan.from_base64
+    )
 
-            with st.spinner('Creating Repair Plan...'):
-                repair_plan = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                             
-                # Remove any non-JSON compliant parts from the string (like Python comments)
-                json_data = repair_plan.split('\n')
-                json_data = [line for line in json_data if not line.strip().startswith('//')]
-                json_data = "\n".join(json_data)
+    st.write("")
+    st.write(assessment["plan"].job_card())
+    st.write("")
+
+    # Time to the job card on the run that produced it
+    assessment.setdefault("ready_seconds", time.perf_counter() - started)
+    st.caption(f"Job card ready in {assessment['ready_seconds']:.1f}s")
 
-                # Remove any leading 'json' keyword and strip any remaining whitespace or special characters
-                json_data = json_data.strip('` \n')
+    resumed_stages, saved_calls, saved_seconds = assessment["checkpoints"].saved()
+    if resumed_stages:
+        st.caption(f"Resumed {resumed_stages} stages from checkpoints, saving {saved_calls} model calls and {saved_seconds:.1f}s")
 
-                if json_data.startswith('json'):
-                    json_data = json_data[4:]  # Remove the first 4 characters 'json'
 
-                try:
-                    # Parse the JSON data
-                    data = json.loads(json_data)
-                    
-                except json.JSONDecodeError as e:
-                    print(f"Failed to decode JSON: {e}")
+    if prefetch and not assessment["prefetched"]:
+        prefetch_lazy_stages(assessment)
+
+    render_lazy_stage(assessment, "cost", "Calculate Repair Cost", 'Calculating Repair Costs...', show_cost)
+    render_lazy_stage(assessment, "drivability", "Assess Drivability", 'Assessing Drivability...', show_drivability)
+    render_lazy_stage(assessment, "triage", "Triage and Allocate", 'Triaging and Allocating...', show_triage)
 
+    if all(stage in assessment["checkpoints"] for stage in LAZY_STAGES):
+        assessment["checkpoints"].finish()
 
-                    #If Repair plan wasnt good JSON then try again
 
-                    repair_plan = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                    # Remove any non-JSON compliant parts from the string (like Python comments)
-                    json_data = repair_plan.split('\n')
-                    json_data = [line for line in json_data if not line.strip().startswith('//')]
-                    json_data = "\n".join(json_data)
+# Keep the latest profile of each kind for the sidebar panel
+def remember_profile(run):
+    st.session_state.setdefault('profiles', {})[run.kind] = {
+        "claim_id": run.claim_id,
+        "path": run.path,
+        **run.summary,
+    }
 
-                    # Remove any leading 'json' keyword and strip any remaining whitespace or special characters
-                    json_data = json_data.strip('` \n')
-
-                    if json_data.startswith('json'):
-                        json_data = json_data[4:]  # Remove the first 4 characters 'json'
-
-                    # Parse the JSON data
-                    data = json.loads(json_data)
-                    
-
-
-                job_card = f"Digital Job Card for Vehicle: {data['reg_no']}\n\n"
 
-                # Damage description
-                job_card += f"Damage Description: {data['damage_description']}\n\n"
-
-                # Adding parts list
-                job_card += "Parts List:\n"
-                for part in data['parts_list']:
-                    job_card += f"  - {part['part']} ({'Position: ' + part['position'] if part['position'] else 'Position: N/A'}): "
-                    actions = []
-                    if part.get('s_r', False):
-                        actions.append("Strip & Refit")
-                    if part.get('repair', False):
-                        actions.append("Repair")
-                    if part.get('replace', False):
-                        actions.append("Replace")
-                    if part.get('paint', False):
-                        actions.append("Paint")
-                    job_card += ", ".join(actions) + "\n"
+def show_profiles():
+    with st.sidebar.expander("Profiling"):
+        profiles = st.session_state.get('profiles', {})
+        if not profiles:
+            st.caption(f"Profiles are written to {profiling.PROFILE_DIR}, the hot spots show here from the next rerun")
+        for kind, summary in sorted(profiles.items()):
+            st.write(f"**Last {kind}** ({summary['claim_id'] or 'no claim'})")
+            st.caption(f"{summary['seconds']}s total, {summary['wait_seconds']}s waiting on the network or locks, {summary['local_seconds']}s local. {summary['path']}")
+            st.table(summary["hot_spots"])
+            st.caption("Our functions by cumulative time")
+            st.table(summary["our_functions"])
 
-                # New parts information
-                job_card += f"\nNew Parts Info:\n  {data['new_parts_info']}\n"
 
-                # Specialist work required
-                job_card += "\nSpecialist Work Required:\n"
-                for key, value in data['specialist_work_required'].items():
-                    if value:
-                        job_card += f"  - {key.replace('_', ' ').title()}\n"
-
-                # Wheels removed for repair
-                job_card += "\nWheels Removed for Repair:\n"
-                for wheel, removed in data['wheels_removed_for_repair'].items():
-                    job_card += f"  - {wheel}: {'Removed' if removed else 'Not Removed'}\n"
-
-                # Smart repairs required
-                job_card += f"\nSmart Repairs Required:\n  {data['smart_repairs_required']}"
-                st.write("")
-                st.write(job_card)
-                st.write("")
-
-
-
-            #Repair plan is done, now to calculate the cost
-                
-
-            system_prompt = "You must use the dictionary and repair plan to create the overall cost of the repair. Take your time and work through the problem to ensure you have the coorect cost."
-            user_prompt = f"Provide the overall cost for the following repair plan: {repair_plan}\n Here is the dictionary of costs: {scaled_costs}. You must only use the full cost for replacement parts, if a part is repaired you should use half of the dictionary cost."
-
-            model = "gpt-4o"
-            
-            with st.spinner('Calculating Repair Costs...'):
-                costs = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                
-
-                #Now to extract the cost from the response
-
-                system_prompt = "You must provide the cost of the repair as a number with no currency symbol or commas."
-                user_prompt = f"Provide the numerical cost for the following: {costs} Do not include any currency symbols and only use two decimal places. Provide no additional text."
-
-                
-                model = "gpt-3.5-turbo-0125"
-                cleaned_cost = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                st.write(f"The cost of the repair is: £{cleaned_cost}")
-                st.write("")
-
-
-
-            #Now for the Drivability check
-
-            example_images = ""
-
-            system_prompt = """
-            You are an expert vehicle damage assessor working with team members at Halo ARC Ltd to triage a vehicle that has been involved in an accident.
-            You will be given a description of the damage and a repair plan as well as image of the vehicle. Your task is to determine if the vehicle is safe to drive
-
-            This is just a test, and will be evaluated by a human who is qualified.
-
-            If any of the following are true, the vehicle is not safe to drive:
-            Any SRS or safety component Deployed (e.g. Airbags)
-            Suspension, wheel, or tyre severely damaged
-            Jagged edges/large tears in the metal
-            Vehicle does not lock
-            Vehicle does not drive
-            Any lamp lens shattered
-            Missing exterior panels (e.g. bumper torn off)
-            Mirror glass damaged or housing not intact
-            Radiator or Condenser visibly damaged and leaking
-            Customer reporting warning lights on the dash (related to accident)
-            Exhaust damage that causes excessive noise or fumes
-            Engine or transmission not working correctly
-            EV Vehicle with underside or High voltage component damage
-            Glass shattered or cracked
-
-            Make no assumptions and only use the information provided to you. If it hasn't been listed on the job card you should not consider it when determining drivability.
-            Mentions on the job card to check components do not suffice as evidence to deem the car non-drivable.
-
-            Your output must be in the structured JSON format as shown in the examples below:
-            example 1: {"drivable": true, "reason": "The vehicle is safe to drive."}
-            example 2: {"drivable": false, "reason": "The vehicle is not safe to drive due to the airbags being deployed and the windscreen being shattered."}
-            example 3: {"drivable": false, "reason": "The vehicle is not safe to drive due to the severe wheel damage and the suspension damage."}
-            """
-
-            user_prompt = f"""
-            I am a qualified vehicle damage assessor and I will be evaluating you.
-            Here is the repair plan for the {make_model}.
-            {repair_plan}
-
-            {formatted_context}
-
-            Using this and the images you have been provided evaluate the drivability of the vehicle and provide your response as JSON.
-            """
-
-            
-
-            with st.spinner('Assessing Drivability...'):
-                drivability_output = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                
-
-
-                #now turn the output into valid json
-
-                system_prompt = "You must parse the input you are provided and return valid json with no backticks or markdown."
-                user_prompt = f"Provide the raw json for the following: {drivability_output}"
-
-                
-                model = "gpt-3.5-turbo-0125"
-                good_drivability = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                
-
-                # Check if good_drivability is not None and is a non-empty string
-                if good_drivability:
-                    try:
-                        # Parse the JSON string into a Python dictionary
-                        parsed_json = json.loads(good_drivability)
-                        print(parsed_json)
-
-                        # Now you can check if 'drivable' is True (Python's False since it's 'false' in the JSON) and print the reason
-                        if parsed_json.get('drivable', False):
-                            st.write("✅ The vehicle is safe to drive.")
-                        else:
-                            st.write("❌ The vehicle is not safe to drive.")
-                            st.write(parsed_json['reason'])
-                    except json.JSONDecodeError as e:
-                        st.write(f"Failed to decode JSON: {e}")
-                else:
-                    st.write("Failed to get a valid response or good_drivability is None or an empty string")
-
-                st.write("")
-
-            
-            #Now for the Triage and Allocation
-            system_prompt = f"""
-            You are an expert vehicle damage assessor working with team members at Halo ARC Ltd to triage a vehicle that has been involved in an accident.
-            You will be given a description of the damage and a repair plan as well as images of the vehicle. Your task is to determine if the vehicle should be sent to a spoke site, a hub site, or escalated for a total loss assessment.
-
-            This is just a test, and will be evaluated by a human who is qualified.
-
-            First you must determine if the repair costs are high enough for the vehicle to be sent for a total loss assessment, or if it can be booked to the correct repair location.
-            To do this, compare the trade retail valuation with the overall repair cost. If the repair cost is 60% or more of the vehicle value it must be escalated as a possible total loss.
-            The vehicle value: {trade_retail}
-            The repair cost: {cleaned_cost}
-
-            If the repairs are within the threshold you may proceed with determing the location it should go to.
-
-            The following is a guide to help you determine which repairs should go to hubs:
-
-            Any SRS or safety component Deployed (e.g. Airbags)
-            Significant suspension damage
-            Welded on panels requiring replacement (e.g. Quarter panel, roof, structural rails)
-            Engine or transmission not working correctly
-            EV Vehicle with underside or High voltage components damaged
-            Excessively Large repairs (e.g. replacement of all panels on the side of a car, damage deep into the engine bay, boot floor replacements)
-            Obvious Radiator support damaged
-
-            As a general guide, most other repairs can be done at spoke sites.
-
-            Make no assumptions and only use the information provided to you.
-
-            Think carefully about all of the damages and provide a thorough explanation for your decision.
-            """
-
-            user_prompt = f"""
-            I am a qualified vehicle damage assessor and I will be evaluating your decision.
-            Here is the repair plan for the {make_model}.
-            {repair_plan}
-
-            {formatted_context}
-
-            Determine if the vehicle should go to total loss, a spoke site, or a hub site based on the information provided.
-            """
-            
-
-            
-            with st.spinner('Triaging and Allocating...'):
-                triage = send_images_to_gpt4(example_images, images, system_prompt, user_prompt, openai_api_key)
-                
-
-                #now turn the output into valid json
-
-
-                system_prompt = "You are assisting a researcher by cleaning data on collision repair. You will be provided a verbose explanation, and you must provide only the final decsion from the following options: Total Loss, Hub Site, Spoke Site. Provide no additional text."
-                user_prompt = f"Provide the decsion for the following: {triage} Use only the final recommendation from the three possible options. Provide no additional text."
-
-                model = "gpt-3.5-turbo-0125"
-                triage_decision = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                
-
-                # Check the decision and display the appropriate message
-                try:
-                    if triage_decision == "Hub Site" or triage_decision == "Spoke Site":
-                        st.write(f"✅ This vehicle should go to a {triage_decision}")
-                    elif triage_decision == "Total Loss":
-                        st.write(f"⚠️ This vehicle should be escalated to a {triage_decision} assessment")
-                    else:
-                        print("Invalid decision or decision not found in response.")
-                except json.JSONDecodeError as e:
-                    print(f"Failed to decode JSON: {e}")
-
-
-
-
-                system_prompt = "You are assisting with a researcher cleaning up data from the collision repair industry. You must summarise the input to help the researcher understand if the vehicle should go to a hub site, a spoke site, or be asssessed as a possible total loss. You should explicitly mention the repair cost percentage of the vehicle value and the reason for the decision. Use no more than 3 sentences. Use markdown formatting to make it as easy to read as possible."
-                user_prompt = f"Provide the short, digestable version of the following: {triage}."
+# Streamlit Page
+def display_page(profiled_run=None):
 
-                
-                model = "gpt-3.5-turbo-0125"
-                triage_short = gpt_turbo_chat(model, system_prompt, user_prompt, openai_api_key)
-                st.write(triage_short)
-                st.write("")
+    st.sidebar.header('Vehicle Damage Upload')
 
+    # Add an example button in the sidebar
+    if st.sidebar.button('Load Example'):
+        set_example_values()
 
-            #All done! Now time for shameless self promotion :D
+    # Vehicle information input
+    vehicle_reg = st.sidebar.text_input("Vehicle Registration Number", value=st.session_state.get('vehicle_reg', ''))
+    FNOL_description = st.sidebar.text_area("First Notification of Loss Description", value=st.session_state.get('FNOL_description', ''))
 
-            ## Path to the Halo ARC Logo
-            #haloarc_logo_path = 'cropped_image_wider.jpg'  # Update this to the path where your QR code image is stored
+    # Image upload
+    uploaded_images = st.sidebar.file_uploader("Upload Damage Images", accept_multiple_files=True, type=['png', 'jpg', 'jpeg'], key="uploaded_images")
 
-            # Path to the QR code image
-            #qr_code_image_path = 'haloarc_job_link_qr.png'  # Update this to the path where your QR code image is stored
+    if uploaded_images:
+        st.session_state['user_images'] = uploaded_images  # Store user-uploaded images in session state
 
-            # Create a 3-column layout (left, center, right)
-            #col1, col2 = st.columns([1,1])
-            
-            #with col1:
-                #st.image(haloarc_logo_path, caption="", use_container_width=True)
+    # Display images (user-uploaded or example)
+    images = st.session_state.get('user_images', []) or st.session_state.get('example_images', [])
 
-            # Use the middle column to display the QR code centered
-            #with col2:
-                # Centering the image in the column
-                #st.image(qr_code_image_path, use_container_width=True)
+    # Hand every image to the ingest pool first so they're decoded and encoded in parallel, and
+    # processing the claim later picks up the encodings instead of starting them
+    pool = ingest.get_pool()
+    uploads = [img_file.getvalue() for img_file in images]
+    refused = sum(not pool.submit(data) for data in uploads)
+    if refused:
+        st.sidebar.caption(f"Image queue is full, preparing {refused} images here")
+    for data in uploads:
+        st.sidebar.image(pool.prepared(data)[1], caption='Uploaded Image', use_container_width=True)
 
+    prefetch = st.sidebar.checkbox("Prefetch cost, drivability and triage", key="prefetch")
 
-            # Use Markdown with HTML to customize the caption text
-            #st.markdown("""
-                #<style>
-                #.big-font {
-                    #font-size:20px;  # Increased font size for better readability
-                    #font-weight:bold;  # Keeps the text bold for emphasis
-                    #line-height:1.5;  # Adds more space between lines for easier reading
-                #}
-                #.center-text {
-                    #text-align: center;  # Ensures text is centered
-                    #margin-top: 20px;  # Adds space above the text block for better layout
-                    #margin-bottom: 20px;  # Adds space below the text block for better layout
-                #}
-                #</style>
-                #<div class='center-text'>
-                    #<p class='big-font'>Join me in revolutionising a neglected industry!<br>We're looking for talented people with that special Spark!</p>
-                #</div>    
-                #""", unsafe_allow_html=True)
+    # Process images button
+    if st.sidebar.button("Process Images"):
+        if images and vehicle_reg and FNOL_description:
+            claim_id = pipeline.make_claim_id(vehicle_reg, images)
+            assessment = get_assessment(claim_id, vehicle_reg, FNOL_description, images)
+            # Processing again retries a failed stage, resuming from the checkpoints before it,
+            # and prefetches the lazy stages again. Prefetches still running are left to finish.
+            assessment["failed"] = None
+            assessment["checkpoints"].start_run()
+            assessment["prefetch"] = {stage: future for stage, future in assessment["prefetch"].items() if not future.done()}
+            assessment["prefetched"] = False
+            assessment["errors"] = {}
+            st.session_state['assessment'] = assessment["key"]
+            if profiled_run is not None:
+                profiled_run.kind = "process"
+
+    if profiling.enabled():
+        show_profiles()
+
+    # The processed claim stays on screen across reruns, e.g. when a lazy stage is requested
+    assessment = st.session_state.get('assessments', {}).get(st.session_state.get('assessment'))
+    if assessment is not None:
+        if profiled_run is not None:
+            profiled_run.claim_id = assessment["claim_id"]
+
+        # Record which model actually served each stage and hold the stages computed on this rerun to
+        # the claim's time budget. Time between reruns, e.g. waiting for a button click, isn't counted.
+        with backends.record_calls(assessment["served_by"]):
+            try:
+                with backends.claim_deadline():
+                    render_assessment(assessment, prefetch)
+            except backends.DeadlineExceeded as e:
+                st.error(f"Stopped before the assessment finished: {e}. Process the images again for a new budget.")
+            except checkpoints.StageFailed as e:
+                st.error(f"{e}. Process the images again to resume from this stage.")
+
+        with st.expander("Models used"):
+            st.table(assessment["served_by"])
+
+
+        #All done! Now time for shameless self promotion :D
+
+        ## Path to the Halo ARC Logo
+        #haloarc_logo_path = 'cropped_image_wider.jpg'  # Update this to the path where your QR code image is stored
+
+        # Path to the QR code image
+        #qr_code_image_path = 'haloarc_job_link_qr.png'  # Update this to the path where your QR code image is stored
+
+        # Create a 3-column layout (left, center, right)
+        #col1, col2 = st.columns([1,1])
+        
+        #with col1:
+            #st.image(haloarc_logo_path, caption="", use_container_width=True)
+
+        # Use the middle column to display the QR code centered
+        #with col2:
+            # Centering the image in the column
+            #st.image(qr_code_image_path, use_container_width=True)
+
+
+        # Use Markdown with HTML to customize the caption text
+        #st.markdown("""
+            #<style>
+            #.big-font {
+                #font-size:20px;  # Increased font size for better readability
+                #font-weight:bold;  # Keeps the text bold for emphasis
+                #line-height:1.5;  # Adds more space between lines for easier reading
+            #}
+            #.center-text {
+                #text-align: center;  # Ensures text is centered
+                #margin-top: 20px;  # Adds space above the text block for better layout
+                #margin-bottom: 20px;  # Adds space below the text block for better layout
+            #}
+            #</style>
+            #<div class='center-text'>
+                #<p class='big-font'>Join me in revolutionising a neglected industry!<br>We're looking for talented people with that special Spark!</p>
+            #</div>    
+            #""", unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
-    display_page()  # If thing then do the thing
+    # Profiles the whole rerun when PROFILE_DIR is set
+    with profiling.profile_run(on_done=remember_profile) as profiled_run:
+        display_page(profiled_run)  # If thing then do the thing
@@ -0,0 +1,483 @@
+import os
+import json
+import math
+import base64
+import time
+import threading
+import contextlib
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+
+# Model backends and per-stage routing.
+# Every model call in the pipeline names its stage. The routing table maps the stage to a model on an
+# endpoint, with an optional latency target and a fallback model used while the primary misses it.
+#
+# The defaults reproduce the models the pipeline has always used. Override any of it with a JSON file
+# named by MODEL_ROUTING_CONFIG, e.g. to send everything to a local OpenAI-compatible stand-in:
+#   {
+#     "endpoints": {"local": {"type": "openai", "url": "http://127.0.0.1:8765/v1/chat/completions"}},
+#     "stages": {"location": {"endpoint": "local", "model": "gpt-4o-mini", "latency_target": 3,
+#                             "fallback": {"endpoint": "openai", "model": "gpt-4o"}}}
+#   }
+# Stage entries are merged over the defaults, so a file only needs the stages it changes.
+#
+# Every call has a timeout: the stage's own "timeout" or whatever is left of the claim budget
+# (CLAIM_BUDGET_SECONDS), whichever is shorter. Once the budget is spent the claim stops with
+# DeadlineExceeded instead of starting stages nobody will wait for.
+#
+# Stages with "hedge": true send a duplicate request once a call has run longer than the stage's
+# observed p95 latency (or a fixed "hedge_after"), and the first response wins. It suits the short
+# classification stages, e.g. {"stages": {"front_rear": {"hedge": true}, "location": {"hedge": true}}}
+
+VISION_MODEL = "gpt-4o"
+TEXT_MODEL = "gpt-3.5-turbo-0125"
+
+# Total seconds a claim may spend across all its model calls
+CLAIM_BUDGET_SECONDS = float(os.environ.get("CLAIM_BUDGET_SECONDS", "600"))
+# Hedging needs this many observed latencies before it trusts the stage's p95
+HEDGE_MIN_SAMPLES = 20
+# Latencies kept per stage for the p95 estimate and the hedging report
+LATENCY_WINDOW = 500
+
+DEFAULT_ROUTING = {
+    "endpoints": {
+        "openai": {
+            "type": "openai",
+            "url": os.environ.get("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions"),
+            "api_key_env": "OPENAI_API_KEY",
+        },
+    },
+    "stages": {
+        "front_rear": {"model": VISION_MODEL},
+        "location": {"model": VISION_MODEL},
+        "front_and_rear": {"model": VISION_MODEL},
+        "location_fix": {"model": TEXT_MODEL, "timeout": 30},
+        "fraud": {"model": VISION_MODEL},
+        "fraud_json": {"model": TEXT_MODEL, "timeout": 30},
+        "repair_plan": {"model": VISION_MODEL, "timeout": 180},
+        "cost": {"model": VISION_MODEL, "timeout": 60},
+        "cost_extract": {"model": TEXT_MODEL, "timeout": 30},
+        "drivability": {"model": VISION_MODEL},
+        "drivability_json": {"model": TEXT_MODEL, "timeout": 30},
+        "triage": {"model": VISION_MODEL},
+        "triage_decision": {"model": TEXT_MODEL, "timeout": 30},
+        "triage_summary": {"model": TEXT_MODEL, "timeout": 30},
+    },
+    # Stage settings used when a stage entry doesn't give its own
+    "defaults": {
+        "endpoint": "openai",
+        "latency_target": None,
+        # Seconds to keep using the fallback after the primary missed its target
+        "recovery_after": 60,
+        # Seconds before a single call is abandoned
+        "timeout": 90,
+        "hedge": False,
+        # Fixed hedge delay in seconds, None uses the stage's observed p95
+        "hedge_after": None,
+    },
+}
+
+
+class BackendError(Exception):
+    pass
+
+
+# Not a BackendError: running out of claim budget stops the claim rather than trying a fallback
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Nearest-rank percentile, good enough for a few hundred samples
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class ChatBackend:
+    # A chat completion endpoint. Subclasses turn messages into the assistant's reply text.
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+
+    # timeout is the most seconds to wait for the reply, None waits forever
+    def complete(self, model, messages, max_tokens, temperature=0, timeout=None):
+        raise NotImplementedError
+
+
+class OpenAIChatBackend(ChatBackend):
+    # OpenAI chat completions, or anything that speaks the same API (Azure OpenAI, vLLM, standins.py)
+
+    def __init__(self, name, settings):
+        super().__init__(name, settings)
+        self.url = settings["url"]
+        self.api_key = os.environ.get(settings.get("api_key_env", ""), settings.get("api_key", ""))
+
+    def complete(self, model, messages, max_tokens, temperature=0, timeout=None):
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+        # Chat completions send nothing until the reply is ready, so the read timeout bounds the whole call.
+        # The body is streamed so image payloads aren't held in memory as one big JSON string.
+        response = requests.post(self.url, headers=headers, data=StreamingJSONBody(payload), timeout=timeout)
+
+        if response.status_code != 200:
+            raise BackendError(f"Request failed with status code {response.status_code}")
+        return response.json()['choices'][0]['message']['content']
+
+
+class JpegDataUrl:
+    # An image_url "url" value holding the raw JPEG. The base64 data: URL is only produced piece by piece
+    # while the request body is written, so no full base64 copy of the image ever exists.
+    prefix = b"data:image/jpeg;base64,"
+
+    def __init__(self, jpeg):
+        self.jpeg = memoryview(jpeg)
+
+    def encoded_length(self):
+        return len(self.prefix) + 4 * math.ceil(len(self.jpeg) / 3) + 2
+
+
+class StreamingJSONBody:
+    # Request body that serialises the payload as it is sent instead of building it in memory.
+    # Each iteration starts over, so retries and hedged duplicates can send it again.
+    # It has a length, so requests sends a Content-Length rather than a chunked body.
+
+    # Multiple of 3 so every slice base64-encodes without padding and the slices join up exactly
+    IMAGE_SLICE = 3 * 16 * 1024
+    # Small JSON pieces are buffered up to about this size before being written
+    WRITE_SIZE = 64 * 1024
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    # JSON text as bytes, with JpegDataUrl values left for __iter__ to encode
+    def _pieces(self, value):
+        if isinstance(value, JpegDataUrl):
+            yield value
+        elif isinstance(value, dict):
+            yield b"{"
+            for i, (key, item) in enumerate(value.items()):
+                yield (b", " if i else b"") + json.dumps(key).encode("utf-8") + b": "
+                yield from self._pieces(item)
+            yield b"}"
+        elif isinstance(value, (list, tuple)):
+            yield b"["
+            for i, item in enumerate(value):
+                if i:
+                    yield b", "
+                yield from self._pieces(item)
+            yield b"]"
+        else:
+            yield json.dumps(value).encode("utf-8")
+
+    def __len__(self):
+        return sum(piece.encoded_length() if isinstance(piece, JpegDataUrl) else len(piece) for piece in self._pieces(self.payload))
+
+    def __iter__(self):
+        buffer = bytearray()
+        for piece in self._pieces(self.payload):
+            if isinstance(piece, JpegDataUrl):
+                buffer += b'"' + piece.prefix
+                for start in range(0, len(piece.jpeg), self.IMAGE_SLICE):
+                    buffer += base64.b64encode(piece.jpeg[start:start + self.IMAGE_SLICE])
+                    if len(buffer) >= self.WRITE_SIZE:
+                        yield bytes(buffer)
+                        buffer.clear()
+                buffer += b'"'
+            else:
+                buffer += piece
+            if len(buffer) >= self.WRITE_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+
+# Backend classes by the "type" given in the endpoint config
+BACKEND_TYPES = {
+    "openai": OpenAIChatBackend,
+}
+
+
+def load_routing_config(path=None):
+    path = path or os.environ.get("MODEL_ROUTING_CONFIG")
+    config = {
+        "endpoints": dict(DEFAULT_ROUTING["endpoints"]),
+        "stages": {stage: dict(route) for stage, route in DEFAULT_ROUTING["stages"].items()},
+        "defaults": dict(DEFAULT_ROUTING["defaults"]),
+    }
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        config["endpoints"].update(overrides.get("endpoints", {}))
+        config["defaults"].update(overrides.get("defaults", {}))
+        for stage, route in overrides.get("stages", {}).items():
+            config["stages"].setdefault(stage, {}).update(route)
+    return config
+
+
+# Calls made in the current claim, set by record_calls()
+_call_log = contextvars.ContextVar("call_log", default=None)
+
+
+# Collect which model served each stage for everything called inside the block.
+# Pass an existing list to keep adding to it, e.g. a claim whose stages run over several reruns.
+# A nested block also hands its calls on to the enclosing one when it exits.
+@contextlib.contextmanager
+def record_calls(calls=None):
+    calls = [] if calls is None else calls
+    outer = _call_log.get()
+    start = len(calls)
+    token = _call_log.set(calls)
+    try:
+        yield calls
+    finally:
+        _call_log.reset(token)
+        if outer is not None and outer is not calls:
+            outer.extend(calls[start:])
+
+
+class Deadline:
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+# Give every model call inside the block a share of one claim budget.
+# Pass the claim's existing Deadline to carry on with its budget rather than starting a new one.
+@contextlib.contextmanager
+def claim_deadline(seconds=None, deadline=None):
+    token = _deadline.set(deadline or Deadline(seconds or CLAIM_BUDGET_SECONDS))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class StageLatency:
+    # Recent latencies for one stage and how often hedging was needed
+
+    def __init__(self):
+        self.primary = deque(maxlen=LATENCY_WINDOW)
+        self.served = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+
+class ModelRouter:
+
+    def __init__(self, config):
+        self.config = config
+        self.backends = {
+            name: BACKEND_TYPES[settings.get("type", "openai")](name, settings)
+            for name, settings in config["endpoints"].items()
+        }
+        # stage -> time until which the stage is routed to its fallback
+        self.degraded_until = {}
+        self.latency = {}
+        self.lock = threading.Lock()
+        # Hedged requests run here so the caller can wait on whichever finishes first
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+    def route(self, stage):
+        if stage not in self.config["stages"]:
+            raise KeyError(f"No model route configured for stage '{stage}'")
+        route = dict(self.config["defaults"])
+        route.update(self.config["stages"][stage])
+        return route
+
+    def _stage_latency(self, stage):
+        with self.lock:
+            return self.latency.setdefault(stage, StageLatency())
+
+    # Seconds this call may take: the stage timeout capped by what is left of the claim budget
+    def _timeout(self, stage, route):
+        deadline = _deadline.get()
+        if deadline is None:
+            return route["timeout"]
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Claim budget of {deadline.seconds:g}s spent before stage '{stage}'")
+        return min(route["timeout"], remaining)
+
+    def _record(self, stage, target, seconds, served, fallback, reason):
+        calls = _call_log.get()
+        if calls is not None:
+            calls.append({
+                "stage": stage,
+                "model": target["model"],
+                "endpoint": target.get("endpoint", self.config["defaults"]["endpoint"]),
+                "seconds": round(seconds, 3),
+                "served": served,
+                "fallback": fallback,
+                "reason": reason,
+            })
+
+    def _attempt(self, target, messages, max_tokens, timeout):
+        endpoint = target.get("endpoint", self.config["defaults"]["endpoint"])
+        start = time.perf_counter()
+        content = self.backends[endpoint].complete(target["model"], messages, max_tokens, timeout=timeout)
+        return content, time.perf_counter() - start
+
+    # Delay before a hedge is sent, None when the stage hasn't seen enough calls to know its p95
+    def _hedge_delay(self, route, latency):
+        if route.get("hedge_after"):
+            return route["hedge_after"]
+        with self.lock:
+            samples = list(latency.primary)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, 95)
+
+    # The duplicate request, only counted as a hedge once it is actually running
+    def _hedge(self, latency, target, messages, max_tokens, timeout):
+        with self.lock:
+            latency.hedged += 1
+        return self._attempt(target, messages, max_tokens, timeout)
+
+    # Send the request, and a duplicate if it runs past the hedge delay. Returns (content, seconds, hedge_won).
+    # Each request runs in its own copy of the caller's context, a context can't be entered by two threads at once.
+    def _hedged_attempt(self, route, messages, max_tokens, timeout, latency):
+        start = time.perf_counter()
+        primary = self.executor.submit(contextvars.copy_context().run, self._attempt, route, messages, max_tokens, timeout)
+
+        # The primary's own latency feeds the p95 and the "without hedging" side of the report,
+        # even when a hedge beat it and nobody is waiting for it any more
+        def record_primary(future):
+            if not future.cancelled() and future.exception() is None:
+                with self.lock:
+                    latency.primary.append(future.result()[1])
+        primary.add_done_callback(record_primary)
+
+        delay = self._hedge_delay(route, latency)
+        if delay is None or delay >= timeout or wait([primary], timeout=delay).done:
+            content, _ = primary.result()
+            return content, time.perf_counter() - start, False
+
+        hedge = self.executor.submit(contextvars.copy_context().run, self._hedge, latency, route, messages, max_tokens, timeout - delay)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser can't be interrupted mid-request, it is abandoned and bounded by its timeout
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        with self.lock:
+                            latency.hedge_wins += 1
+                    return future.result()[0], time.perf_counter() - start, future is hedge
+        raise primary.exception()
+
+    def _serve(self, stage, target, messages, max_tokens, fallback, reason=None):
+        route_timeout = self._timeout(stage, target)
+        latency = self._stage_latency(stage)
+        start = time.perf_counter()
+        try:
+            if target.get("hedge"):
+                content, seconds, hedge_won = self._hedged_attempt(target, messages, max_tokens, route_timeout, latency)
+                if hedge_won:
+                    reason = "hedged request won"
+            else:
+                content, seconds = self._attempt(target, messages, max_tokens, route_timeout)
+                with self.lock:
+                    latency.primary.append(seconds)
+        except requests.Timeout:
+            self._record(stage, target, time.perf_counter() - start, False, fallback, reason)
+            deadline = _deadline.get()
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(f"Claim budget of {deadline.seconds:g}s spent during stage '{stage}'")
+            raise BackendError(f"Stage '{stage}' timed out after {route_timeout:.0f}s")
+        except Exception:
+            self._record(stage, target, time.perf_counter() - start, False, fallback, reason)
+            raise
+
+        with self.lock:
+            latency.calls += 1
+            latency.served.append(seconds)
+        self._record(stage, target, seconds, True, fallback, reason)
+        return content, seconds
+
+    # Send messages for a stage to its routed model, falling back when the primary is failing or slow
+    def complete(self, stage, messages, max_tokens):
+        route = self.route(stage)
+        fallback = route.get("fallback")
+        if fallback:
+            # The fallback shares the stage's timeout and hedging settings unless it sets its own
+            fallback = {**{key: route[key] for key in ("timeout", "hedge", "hedge_after")}, **fallback}
+
+        with self.lock:
+            degraded = time.monotonic() < self.degraded_until.get(stage, 0)
+        if fallback and degraded:
+            return self._serve(stage, fallback, messages, max_tokens, True, "primary missed latency target")[0]
+
+        try:
+            content, seconds = self._serve(stage, route, messages, max_tokens, False)
+        except (BackendError, requests.RequestException) as e:
+            if not fallback:
+                raise
+            return self._serve(stage, fallback, messages, max_tokens, True, f"primary failed: {e}")[0]
+
+        target = route.get("latency_target")
+        if fallback and target and seconds > target:
+            with self.lock:
+                self.degraded_until[stage] = time.monotonic() + route["recovery_after"]
+        return content
+
+    # Per stage hedge rate and tail latency with hedging (served) against the primary request alone
+    def hedge_report(self):
+        report = {}
+        with self.lock:
+            stages = {stage: (latency.calls, latency.hedged, latency.hedge_wins, list(latency.served), list(latency.primary))
+                      for stage, latency in self.latency.items() if self.route(stage).get("hedge")}
+        for stage, (calls, hedged, wins, served, primary) in stages.items():
+            report[stage] = {
+                "calls": calls,
+                "hedged": hedged,
+                "hedge_rate": hedged / calls if calls else 0.0,
+                "hedge_wins": wins,
+                "p95_served": percentile(served, 95),
+                "p99_served": percentile(served, 99),
+                "p95_primary": percentile(primary, 95),
+                "p99_primary": percentile(primary, 99),
+            }
+        return report
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(load_routing_config())
+        return _router
@@ -0,0 +1,242 @@
+import io
+import sys
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+
+from PIL import Image
+
+import backends
+import ingest
+import pipeline
+import repair_model
+import standins
+
+# Micro-benchmarks for the local (non-network) parts of the pipeline.
+#
+#   python benchmark.py payload --images 20
+#       Peak memory and time to build and serialise one vision request body, the old way
+#       (base64 strings in the messages, then json.dumps) against the streamed body.
+#
+#   python benchmark.py results --claims 5000
+#       Memory held per stored repair plan as parsed dicts, as repair_model.RepairPlan objects and
+#       as RepairPlan bytes, plus (de)serialisation and job card rendering time for each.
+#
+#   python benchmark.py ingest --images 20 --workers 4
+#       Time the calling (script) thread spends on image work for one claim's five vision stages:
+#       the old full-size re-encode per stage against the ingest pool picking up prepared encodings.
+
+EXAMPLE_PHOTOS = [
+    "Photo 2024-01-24 10-52-36.jpg",
+    "Photo 2024-01-24 10-52-52.jpg",
+    "Photo 2024-01-24 10-53-00.jpg",
+]
+
+
+# Uploaded photos as the app holds them, cycling the example photos up to count
+def load_uploads(count):
+    uploads = []
+    for i in range(count):
+        with open(EXAMPLE_PHOTOS[i % len(EXAMPLE_PHOTOS)], "rb") as f:
+            uploads.append(io.BytesIO(f.read()))
+    return uploads
+
+
+# Returns (peak MB above the starting point, seconds, result) for fn()
+def measure(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return peak / (1024 * 1024), seconds, result
+
+
+# Returns (MB still allocated once fn() has returned, seconds, result), the result is kept alive until measured
+def measure_retained(fn):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained / (1024 * 1024), seconds, result
+
+
+def payload_for(messages):
+    return {"model": backends.VISION_MODEL, "messages": messages, "max_tokens": 4000, "temperature": 0}
+
+
+# What send_images_to_gpt4 used to do: full base64 strings in the messages, then requests' json.dumps + encode
+def legacy_body(images, system_prompt, user_prompt):
+    content = [{"type": "text", "text": user_prompt}]
+    for image in images:
+        base64_image = base64.b64encode(pipeline.encode_image(image)).decode('utf-8')
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": content}]
+    body = json.dumps(payload_for(messages)).encode("utf-8")
+    return len(body)
+
+
+def streamed_body(images, system_prompt, user_prompt):
+    messages = pipeline.build_vision_messages("", images, system_prompt, user_prompt)
+    body = backends.StreamingJSONBody(payload_for(messages))
+    # Stand in for the socket: consume each chunk and let it go
+    return sum(len(chunk) for chunk in body)
+
+
+def bench_payload(args):
+    images = load_uploads(args.images)
+    system_prompt = "You are assisting and Accident Repair group by identifying the damage location on vehicles."
+    user_prompt = "Identify the location of the damage on the vehicle from the options provided."
+
+    print(f"One vision request with {args.images} photos, best of {args.repeat}")
+    print(f"{'body':<10} {'peak MB':>8} {'seconds':>8} {'body MB':>8}")
+    for name, fn in (("json", legacy_body), ("streamed", streamed_body)):
+        runs = [measure(lambda: fn(images, system_prompt, user_prompt)) for _ in range(args.repeat)]
+        peak = min(run[0] for run in runs)
+        seconds = min(run[1] for run in runs)
+        size = runs[0][2] / (1024 * 1024)
+        print(f"{name:<10} {peak:>8.1f} {seconds:>8.2f} {size:>8.1f}")
+
+
+# What format_job_card used to do: build the card up with repeated += on the parsed dict
+def legacy_job_card(data):
+    job_card = f"Digital Job Card for Vehicle: {data['reg_no']}\n\n"
+    job_card += f"Damage Description: {data['damage_description']}\n\n"
+    job_card += "Parts List:\n"
+    for part in data['parts_list']:
+        job_card += f"  - {part['part']} ({'Position: ' + part['position'] if part['position'] else 'Position: N/A'}): "
+        actions = []
+        if part.get('s_r', False):
+            actions.append("Strip & Refit")
+        if part.get('repair', False):
+            actions.append("Repair")
+        if part.get('replace', False):
+            actions.append("Replace")
+        if part.get('paint', False):
+            actions.append("Paint")
+        job_card += ", ".join(actions) + "\n"
+    job_card += f"\nNew Parts Info:\n  {data['new_parts_info']}\n"
+    job_card += "\nSpecialist Work Required:\n"
+    for key, value in data['specialist_work_required'].items():
+        if value:
+            job_card += f"  - {key.replace('_', ' ').title()}\n"
+    job_card += "\nWheels Removed for Repair:\n"
+    for wheel, removed in data['wheels_removed_for_repair'].items():
+        job_card += f"  - {wheel}: {'Removed' if removed else 'Not Removed'}\n"
+    job_card += f"\nSmart Repairs Required:\n  {data['smart_repairs_required']}"
+    return job_card
+
+
+# Repair plan JSON as the model returns it, one per claim with its own registration
+def repair_plan_texts(count):
+    template = json.dumps(standins.REPAIR_PLAN, indent=4)
+    return [template.replace(standins.REPAIR_PLAN["reg_no"], f"CL{i:05d}X") for i in range(count)]
+
+
+def bench_results(args):
+    texts = repair_plan_texts(args.claims)
+    stored = {
+        "dict": lambda: [json.loads(text) for text in texts],
+        "model": lambda: [repair_model.RepairPlan.from_dict(json.loads(text)) for text in texts],
+        "bytes": lambda: [repair_model.RepairPlan.from_dict(json.loads(text)).to_bytes() for text in texts],
+    }
+    serialise = {
+        "dict": (lambda plan: json.dumps(plan).encode("utf-8"), lambda blob: json.loads(blob)),
+        "model": (lambda plan: plan.to_bytes(), repair_model.RepairPlan.from_bytes),
+        "bytes": (lambda blob: blob, lambda blob: repair_model.RepairPlan.from_bytes(blob)),
+    }
+    job_card = {
+        "dict": legacy_job_card,
+        "model": lambda plan: plan.job_card(),
+        "bytes": lambda blob: repair_model.RepairPlan.from_bytes(blob).job_card(),
+    }
+
+    print(f"{args.claims} stored repair plans, best of {args.repeat}")
+    print(f"{'held as':<8} {'MB':>7} {'bytes/claim':>11} {'blob bytes':>10} {'dump ms':>8} {'load ms':>8} {'card ms':>8}")
+    for name in ("dict", "model", "bytes"):
+        runs = [measure_retained(stored[name]) for _ in range(args.repeat)]
+        retained = min(run[0] for run in runs)
+        plans = runs[0][2]
+        dump, load = serialise[name]
+
+        blobs, dump_seconds = timed(lambda: [dump(plan) for plan in plans], args.repeat)
+        _, load_seconds = timed(lambda: [load(blob) for blob in blobs], args.repeat)
+        _, card_seconds = timed(lambda: [job_card[name](plan) for plan in plans], args.repeat)
+
+        print(
+            f"{name:<8} {retained:>7.1f} {retained * 1024 * 1024 / args.claims:>11.0f} {len(blobs[0]):>10} "
+            f"{dump_seconds * 1000:>8.1f} {load_seconds * 1000:>8.1f} {card_seconds * 1000:>8.1f}"
+        )
+
+
+# What encode_image used to do on the script thread for every vision stage: full-size decode and re-encode
+def legacy_encode(upload):
+    buffered = io.BytesIO()
+    Image.open(io.BytesIO(upload.getvalue())).convert('RGB').save(buffered, format="JPEG")
+    return buffered.getbuffer()
+
+
+def bench_ingest(args):
+    uploads = load_uploads(args.images)
+    stages = 5
+
+    print(f"{args.images} photos, {stages} vision stages, {args.workers} ingest workers")
+    print(f"{'encoding':<22} {'wall s':>7} {'script thread cpu s':>19}")
+
+    start, cpu = time.perf_counter(), time.thread_time()
+    for _ in range(stages):
+        for upload in uploads:
+            legacy_encode(upload)
+    print(f"{'per stage, on thread':<22} {time.perf_counter() - start:>7.2f} {time.thread_time() - cpu:>19.2f}")
+
+    pool = ingest.IngestPool(workers=args.workers, queue_depth=max(args.images, 1))
+    # Warm the workers up so process start-up isn't counted
+    pool.prepared(uploads[0].getvalue())
+    pool.ready.clear()
+
+    start, cpu = time.perf_counter(), time.thread_time()
+    for upload in uploads:
+        pool.submit(upload.getvalue())
+    for _ in range(stages):
+        for upload in uploads:
+            pool.prepared(upload.getvalue())
+    print(f"{'ingest pool':<22} {time.perf_counter() - start:>7.2f} {time.thread_time() - cpu:>19.2f}")
+
+
+# Best of repeat runs of fn, returns (result, seconds)
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+BENCHMARKS = {
+    "payload": bench_payload,
+    "results": bench_results,
+    "ingest": bench_ingest,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collision AI local benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--images", type=int, default=20, help="Photos per claim")
+    parser.add_argument("--claims", type=int, default=5000, help="Stored claims for the results benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=ingest.INGEST_WORKERS, help="Ingest pool workers")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+    sys.exit(0)
@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+
+import backends
+
+# Per-stage checkpoints for each claim.
+# Every stage that completes is saved against the claim ID, so processing the claim again after a
+# failure resumes from the first stage that failed instead of repeating the vision calls that worked.
+# Once every stage has succeeded the claim's checkpoints are cleared, so processing it again assesses
+# it afresh. Checkpoints of claims that were never finished expire after CHECKPOINT_TTL_SECONDS.
+# The store also keeps running totals of the model calls and time that resuming has saved.
+#
+# Checkpoints are kept in a SQLite file (CHECKPOINT_PATH) by default. SQLite's locking doesn't hold on
+# network filesystems, so replicas that share their checkpoints set CHECKPOINT_DIR to a directory on
+# the shared filesystem instead, where they are kept as plain files.
+
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", "checkpoints.sqlite3")
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR")
+CHECKPOINT_TTL_SECONDS = float(os.environ.get("CHECKPOINT_TTL_SECONDS", str(24 * 60 * 60)))
+# Seconds between sweeps of the checkpoint directory for expired checkpoints of other claims
+CHECKPOINT_SWEEP_SECONDS = 60 * 60
+
+
+class StageFailed(Exception):
+    # A stage raised or returned an error. Everything before it is checkpointed.
+
+    def __init__(self, stage, error):
+        super().__init__(f"The {stage} stage failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+# The error of a failed model call in a stage output, if any. Model calls that fail come back as
+# {"error": ...}, either as the whole output or as one of its values (e.g. the decision in the
+# triage outcome). A reply that couldn't be parsed is a result to show, not a failed stage: the
+# model runs at temperature 0, so retrying would usually get the same reply.
+def _failed_call(value):
+    return isinstance(value, dict) and set(value) == {"error"}
+
+
+def stage_error(output):
+    if _failed_call(output):
+        return output["error"]
+    if isinstance(output, dict):
+        for value in output.values():
+            if _failed_call(value):
+                return value["error"]
+    return None
+
+
+class CheckpointStore:
+
+    def __init__(self, path=CHECKPOINT_PATH, ttl=CHECKPOINT_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stage_checkpoints ("
+                "claim_id TEXT NOT NULL, stage TEXT NOT NULL, output TEXT NOT NULL, "
+                "model_calls INTEGER NOT NULL, seconds REAL NOT NULL, saved_at REAL NOT NULL, "
+                "PRIMARY KEY (claim_id, stage))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS resume_savings ("
+                "stage TEXT PRIMARY KEY, resumes INTEGER NOT NULL, model_calls INTEGER NOT NULL, seconds REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per call keeps the store safe to use from concurrent sessions and workers
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # {stage: {"output", "model_calls", "seconds"}} for every stage completed on the claim within the TTL
+    def load(self, claim_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM stage_checkpoints WHERE saved_at < ?", (time.time() - self.ttl,))
+            rows = conn.execute(
+                "SELECT stage, output, model_calls, seconds FROM stage_checkpoints WHERE claim_id = ?", (claim_id,)
+            ).fetchall()
+        return {
+            stage: {"output": json.loads(output), "model_calls": model_calls, "seconds": seconds}
+            for stage, output, model_calls, seconds in rows
+        }
+
+    def save(self, claim_id, stage, output, model_calls, seconds):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stage_checkpoints (claim_id, stage, output, model_calls, seconds, saved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (claim_id, stage, json.dumps(output), model_calls, seconds, time.time()),
+            )
+
+    def clear(self, claim_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM stage_checkpoints WHERE claim_id = ?", (claim_id,))
+
+    def record_resume(self, stage, model_calls, seconds):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO resume_savings (stage, resumes, model_calls, seconds) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (stage) DO UPDATE SET resumes = resumes + 1, "
+                "model_calls = model_calls + excluded.model_calls, seconds = seconds + excluded.seconds",
+                (stage, model_calls, seconds),
+            )
+
+    # {stage: {"resumes", "model_calls", "seconds"}}, what resuming has saved so far
+    def savings(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT stage, resumes, model_calls, seconds FROM resume_savings ORDER BY stage").fetchall()
+        return {
+            stage: {"resumes": resumes, "model_calls": model_calls, "seconds": round(seconds, 2)}
+            for stage, resumes, model_calls, seconds in rows
+        }
+
+
+# A file written to a temporary name and renamed into place, so readers never see a partial write
+def _write_json(path, value):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+class DirectoryCheckpointStore:
+    # The CheckpointStore as files, safe to share between replicas on a network filesystem.
+    # Each claim has a directory with one JSON file per completed stage. Resume savings are written
+    # by each process to a file of its own and added up when read, so no two replicas write one file.
+
+    def __init__(self, directory=CHECKPOINT_DIR, ttl=CHECKPOINT_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        self.claims_dir = os.path.join(directory, "claims")
+        self.savings_dir = os.path.join(directory, "savings")
+        os.makedirs(self.claims_dir, exist_ok=True)
+        os.makedirs(self.savings_dir, exist_ok=True)
+        self.savings_path = os.path.join(self.savings_dir, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.swept_at = 0
+
+    # Claim IDs go through a digest so any ID makes a valid directory name
+    def _claim_dir(self, claim_id):
+        return os.path.join(self.claims_dir, hashlib.sha1(claim_id.encode("utf-8")).hexdigest())
+
+    def _expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.ttl
+        except FileNotFoundError:
+            return True
+
+    # Remove expired checkpoints of every claim, at most once per CHECKPOINT_SWEEP_SECONDS
+    def _sweep(self):
+        if time.time() - self.swept_at < CHECKPOINT_SWEEP_SECONDS:
+            return
+        self.swept_at = time.time()
+        for claim_dir in os.listdir(self.claims_dir):
+            claim_dir = os.path.join(self.claims_dir, claim_dir)
+            try:
+                names = os.listdir(claim_dir)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if name.endswith(".json") and self._expired(os.path.join(claim_dir, name)):
+                    try:
+                        os.remove(os.path.join(claim_dir, name))
+                    except FileNotFoundError:
+                        pass
+            try:
+                os.rmdir(claim_dir)
+            except OSError:
+                # Not empty
+                pass
+
+    def load(self, claim_id):
+        self._sweep()
+        claim_dir = self._claim_dir(claim_id)
+        try:
+            names = os.listdir(claim_dir)
+        except FileNotFoundError:
+            return {}
+        completed = {}
+        for name in names:
+            path = os.path.join(claim_dir, name)
+            if not name.endswith(".json") or self._expired(path):
+                continue
+            try:
+                with open(path) as f:
+                    checkpoint = json.load(f)
+            except FileNotFoundError:
+                # Cleared since the directory was listed
+                continue
+            completed[name[:-len(".json")]] = checkpoint
+        return completed
+
+    def save(self, claim_id, stage, output, model_calls, seconds):
+        claim_dir = self._claim_dir(claim_id)
+        os.makedirs(claim_dir, exist_ok=True)
+        _write_json(os.path.join(claim_dir, f"{stage}.json"), {"output": output, "model_calls": model_calls, "seconds": seconds})
+
+    def clear(self, claim_id):
+        shutil.rmtree(self._claim_dir(claim_id), ignore_errors=True)
+
+    def record_resume(self, stage, model_calls, seconds):
+        with self.lock:
+            totals = self.totals.setdefault(stage, {"resumes": 0, "model_calls": 0, "seconds": 0.0})
+            totals["resumes"] += 1
+            totals["model_calls"] += model_calls
+            totals["seconds"] += seconds
+            _write_json(self.savings_path, self.totals)
+
+    def savings(self):
+        totals = {}
+        for name in os.listdir(self.savings_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.savings_dir, name)) as f:
+                    process_totals = json.load(f)
+            except FileNotFoundError:
+                continue
+            for stage, saved in process_totals.items():
+                stage_totals = totals.setdefault(stage, {"resumes": 0, "model_calls": 0, "seconds": 0.0})
+                for key in stage_totals:
+                    stage_totals[key] += saved[key]
+        return {
+            stage: {**totals[stage], "seconds": round(totals[stage]["seconds"], 2)}
+            for stage in sorted(totals)
+        }
+
+
+# The store set up by the environment: the checkpoint directory when CHECKPOINT_DIR is set, otherwise SQLite
+def open_store():
+    return DirectoryCheckpointStore() if CHECKPOINT_DIR else CheckpointStore()
+
+
+class ClaimCheckpoints:
+    # The checkpointed stages of one claim. run() returns a stage's saved output when there is
+    # one, otherwise computes it and saves it if it succeeded.
+
+    def __init__(self, claim_id, store=None):
+        self.claim_id = claim_id
+        self.store = store or open_store()
+        self.completed = self.store.load(claim_id)
+        self.finished = False
+        self.lock = threading.Lock()
+        self.start_run()
+
+    # Start a new pass over the stages. Each checkpoint the pass reuses counts once as a resume.
+    def start_run(self):
+        self.used = set()
+        self.resumed = []
+
+    def __contains__(self, stage):
+        return stage in self.completed
+
+    def output(self, stage):
+        return self.completed[stage]["output"]
+
+    # load turns a stage's stored output into what callers get back, e.g. a model object from its
+    # serialised form. It runs as part of the stage, so an output it can't load fails the stage rather
+    # than being saved, and a saved checkpoint it can no longer load is computed again.
+    def run(self, stage, compute, load=None):
+        load = load or (lambda output: output)
+        with self.lock:
+            checkpoint = self.completed.get(stage)
+        if checkpoint is not None:
+            try:
+                value = load(checkpoint["output"])
+            except Exception as e:
+                print(f"Discarding the {stage} checkpoint of {self.claim_id}, it can't be loaded: {e}")
+                with self.lock:
+                    self.completed.pop(stage, None)
+                checkpoint = None
+            else:
+                with self.lock:
+                    if stage not in self.used:
+                        self.used.add(stage)
+                        self.resumed.append(stage)
+                        self.store.record_resume(stage, checkpoint["model_calls"], checkpoint["seconds"])
+                return value
+
+        start = time.perf_counter()
+        with backends.record_calls() as calls:
+            try:
+                output = compute()
+            except backends.DeadlineExceeded:
+                raise
+            except Exception as e:
+                raise StageFailed(stage, e) from e
+        seconds = time.perf_counter() - start
+
+        error = stage_error(output)
+        if error:
+            raise StageFailed(stage, error)
+
+        # Round trip through JSON so a fresh run and a resumed one see the same types
+        output = json.loads(json.dumps(output))
+        try:
+            value = load(output)
+        except Exception as e:
+            raise StageFailed(stage, e) from e
+
+        self.store.save(self.claim_id, stage, output, len(calls), seconds)
+        with self.lock:
+            self.used.add(stage)
+            self.completed[stage] = {"output": output, "model_calls": len(calls), "seconds": seconds}
+        return value
+
+    # Every stage succeeded: clear the stored checkpoints so the claim is assessed afresh next time.
+    # The outputs stay available on this object.
+    def finish(self):
+        if not self.finished:
+            self.store.clear(self.claim_id)
+            self.finished = True
+
+    # (stages, model calls, seconds) this pass saved by resuming
+    def saved(self):
+        checkpoints = [self.completed[stage] for stage in self.resumed]
+        return (
+            len(checkpoints),
+            sum(checkpoint["model_calls"] for checkpoint in checkpoints),
+            sum(checkpoint["seconds"] for checkpoint in checkpoints),
+        )
@@ -0,0 +1,383 @@
+import os
+import io
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import datetime
+import itertools
+from contextlib import closing
+
+import numpy as np
+from PIL import Image
+
+import ingest
+
+# Local fraud pre-screening, runs before the fraud model call.
+# Checks EXIF consistency, looks for screen-capture/moire patterns and searches a persistent
+# perceptual-hash index of every image seen on past claims for re-used photos.
+# The original photo is only opened for its metadata. The pixel checks run on the ingest pool's
+# prepared image (oriented and at most MAX_IMAGE_SIDE), the one the model calls send, so the full
+# resolution photo is never decoded here.
+#
+# The index is a SQLite file (FRAUD_INDEX_PATH) by default. SQLite's locking doesn't hold on network
+# filesystems, so replicas that share one index set FRAUD_INDEX_DIR to a directory on the shared
+# filesystem instead, where it is kept as plain files.
+
+FRAUD_INDEX_PATH = os.environ.get("FRAUD_INDEX_PATH", "fraud_index.sqlite3")
+FRAUD_INDEX_DIR = os.environ.get("FRAUD_INDEX_DIR")
+
+# Hamming distance (out of 64 bits) at or below which two images are treated as the same photo
+DUPLICATE_DISTANCE = int(os.environ.get("FRAUD_DUPLICATE_DISTANCE", "4"))
+# Hamming distance at or below which a match is reported as a possible re-use for a human to check
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("FRAUD_NEAR_DUPLICATE_DISTANCE", "10"))
+# Ratio of the strongest high-frequency peaks to the median spectrum above which we suspect moire
+MOIRE_THRESHOLD = float(os.environ.get("FRAUD_MOIRE_THRESHOLD", "60"))
+# Photos on one claim taken further apart than this are suspicious
+MAX_CAPTURE_SPREAD_DAYS = 3
+
+# Common phone/monitor resolutions, an image exactly this size with no camera metadata is likely a screenshot
+SCREEN_RESOLUTIONS = {
+    (1280, 720), (1366, 768), (1440, 900), (1536, 864), (1600, 900), (1920, 1080), (1920, 1200),
+    (2560, 1440), (2560, 1600), (3840, 2160), (750, 1334), (828, 1792), (1080, 1920), (1080, 2340),
+    (1080, 2400), (1170, 2532), (1179, 2556), (1284, 2778), (1290, 2796), (1440, 3200),
+}
+
+# Editing software that shouldn't appear on photos taken at the scene
+EDITING_SOFTWARE = ("photoshop", "gimp", "lightroom", "snapseed", "picsart", "pixlr", "canva")
+
+# EXIF tag ids
+EXIF_IFD = 0x8769
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_SOFTWARE = 305
+TAG_DATETIME = 306
+TAG_DATETIME_ORIGINAL = 36867
+TAG_ORIENTATION = 274
+# EXIF orientations that rotate the photo a quarter turn, swapping its width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+
+
+# Raw bytes for any of the image inputs the app handles (path, UploadedFile or BytesIO)
+def read_image_bytes(image_input):
+    if isinstance(image_input, str):
+        with open(image_input, "rb") as image_file:
+            return image_file.read()
+    if hasattr(image_input, 'getvalue'):
+        return image_input.getvalue()
+    raise ValueError("Unsupported input type for fraud pre-screening")
+
+
+# 64 bit difference hash, robust to re-compression, resizing and small colour changes
+def dhash(image, hash_size=8):
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def split_hash(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(HASH_CHUNKS)]
+
+
+# Every chunk value within `radius` bits of `chunk`
+def chunk_neighbours(chunk, radius):
+    neighbours = [chunk]
+    for flips in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), flips):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            neighbours.append(flipped)
+    return neighbours
+
+
+# SQLite stores signed 64 bit integers
+def to_signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class HashIndex:
+    # Persistent perceptual-hash index using multi-index hashing.
+    # Each 64 bit hash is split into 4 indexed 16 bit chunks. Two hashes within distance r must
+    # have at least one chunk within distance r // 4 (pigeonhole), so a search only has to look up
+    # a handful of chunk values in the indexes rather than scan every stored image.
+
+    def __init__(self, path=FRAUD_INDEX_PATH):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_hashes ("
+                "id INTEGER PRIMARY KEY, claim_id TEXT NOT NULL, vehicle_reg TEXT, image_name TEXT, hash INTEGER NOT NULL, "
+                "c0 INTEGER NOT NULL, c1 INTEGER NOT NULL, c2 INTEGER NOT NULL, c3 INTEGER NOT NULL, "
+                "added_at REAL NOT NULL, UNIQUE (claim_id, hash))"
+            )
+            # Indexes created before the registration was stored, their rows count as another vehicle
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(image_hashes)")]
+            if "vehicle_reg" not in columns:
+                conn.execute("ALTER TABLE image_hashes ADD COLUMN vehicle_reg TEXT")
+            for i in range(HASH_CHUNKS):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_image_hashes_c{i} ON image_hashes (c{i})")
+
+    def _connect(self):
+        # A connection per call keeps the index safe to use from concurrent Streamlit sessions
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def add(self, claim_id, image_name, value, vehicle_reg=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO image_hashes (claim_id, vehicle_reg, image_name, hash, c0, c1, c2, c3, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (claim_id, vehicle_reg, image_name, to_signed(value), *split_hash(value), time.time()),
+            )
+
+    # Images from other claims within max_distance of value, closest first
+    def search(self, value, max_distance=NEAR_DUPLICATE_DISTANCE, exclude_claim_id=None):
+        radius = max_distance // HASH_CHUNKS
+        conditions = []
+        params = []
+        for i, chunk in enumerate(split_hash(value)):
+            neighbours = chunk_neighbours(chunk, radius)
+            conditions.append(f"c{i} IN ({','.join('?' * len(neighbours))})")
+            params.extend(neighbours)
+
+        query = f"SELECT claim_id, vehicle_reg, image_name, hash FROM image_hashes WHERE ({' OR '.join(conditions)})"
+        if exclude_claim_id is not None:
+            query += " AND claim_id != ?"
+            params.append(exclude_claim_id)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        matches = []
+        for claim_id, vehicle_reg, image_name, stored in rows:
+            distance = hamming_distance(value, to_unsigned(stored))
+            if distance <= max_distance:
+                matches.append({"claim_id": claim_id, "vehicle_reg": vehicle_reg, "image_name": image_name, "distance": distance})
+        return sorted(matches, key=lambda match: match["distance"])
+
+    def __len__(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0]
+
+
+class DirectoryHashIndex:
+    # The HashIndex as files, safe to share between replicas on a network filesystem.
+    # Each image is a JSON file under entries/ named by its hash and claim, and each of its chunks an
+    # empty marker file of the same name under chunks/<chunk>/<chunk value>/. A search lists the
+    # marker directories of the neighbouring chunk values, reads the hash from each name and only
+    # opens the entries close enough to match. A million images leave ~15 markers per directory.
+
+    def __init__(self, directory=FRAUD_INDEX_DIR):
+        self.directory = directory
+        self.entries_dir = os.path.join(directory, "entries")
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+    def _chunk_dir(self, i, chunk):
+        return os.path.join(self.directory, "chunks", str(i), f"{chunk:04x}")
+
+    def add(self, claim_id, image_name, value, vehicle_reg=None):
+        name = f"{value:016x}-{hashlib.sha1(claim_id.encode('utf-8')).hexdigest()[:16]}"
+        path = os.path.join(self.entries_dir, f"{name}.json")
+        # Like UNIQUE (claim_id, hash) in the SQLite index, the first image of the claim with the hash is kept
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"claim_id": claim_id, "vehicle_reg": vehicle_reg, "image_name": image_name, "added_at": time.time()}, f)
+            os.replace(tmp_path, path)
+        # Markers after the entry, so a search never finds a marker without one
+        for i, chunk in enumerate(split_hash(value)):
+            chunk_dir = self._chunk_dir(i, chunk)
+            os.makedirs(chunk_dir, exist_ok=True)
+            open(os.path.join(chunk_dir, name), "a").close()
+
+    # Images from other claims within max_distance of value, closest first
+    def search(self, value, max_distance=NEAR_DUPLICATE_DISTANCE, exclude_claim_id=None):
+        radius = max_distance // HASH_CHUNKS
+        names = set()
+        for i, chunk in enumerate(split_hash(value)):
+            for neighbour in chunk_neighbours(chunk, radius):
+                try:
+                    names.update(os.listdir(self._chunk_dir(i, neighbour)))
+                except FileNotFoundError:
+                    continue
+
+        matches = []
+        for name in names:
+            distance = hamming_distance(value, int(name[:16], 16))
+            if distance > max_distance:
+                continue
+            with open(os.path.join(self.entries_dir, f"{name}.json")) as f:
+                entry = json.load(f)
+            if entry["claim_id"] != exclude_claim_id:
+                matches.append({"claim_id": entry["claim_id"], "vehicle_reg": entry["vehicle_reg"], "image_name": entry["image_name"], "distance": distance})
+        return sorted(matches, key=lambda match: match["distance"])
+
+    def __len__(self):
+        return sum(name.endswith(".json") for name in os.listdir(self.entries_dir))
+
+
+# The index set up by the environment: the index directory when FRAUD_INDEX_DIR is set, otherwise SQLite
+def open_index():
+    return DirectoryHashIndex() if FRAUD_INDEX_DIR else HashIndex()
+
+
+def read_exif(image):
+    exif = image.getexif()
+    width, height = image.size
+    if exif.get(TAG_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    exif_ifd = exif.get_ifd(EXIF_IFD) if exif else {}
+    captured = exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif.get(TAG_DATETIME)
+    try:
+        captured = datetime.datetime.strptime(str(captured).strip("\x00 "), "%Y:%m:%d %H:%M:%S") if captured else None
+    except ValueError:
+        captured = None
+    make = str(exif.get(TAG_MAKE, "")).strip("\x00 ")
+    model = str(exif.get(TAG_MODEL, "")).strip("\x00 ")
+    return {
+        "captured": captured,
+        "device": f"{make} {model}".strip(),
+        "software": str(exif.get(TAG_SOFTWARE, "")).strip("\x00 "),
+        # Size of the photo as taken, the right way up
+        "size": (width, height),
+    }
+
+
+# Findings from the EXIF data across all images on the claim
+def check_exif(exif_data):
+    findings = []
+
+    missing = [name for name, exif in exif_data if not exif["captured"] and not exif["device"]]
+    if missing:
+        findings.append(f"No camera metadata on {', '.join(missing)} (screenshots, downloads and edited images usually have none)")
+
+    for name, exif in exif_data:
+        if exif["software"] and exif["software"].lower().startswith(EDITING_SOFTWARE):
+            findings.append(f"{name} was saved by editing software ({exif['software']})")
+        if exif["captured"] and exif["captured"] > datetime.datetime.now() + datetime.timedelta(days=1):
+            findings.append(f"{name} has a capture time in the future ({exif['captured']:%Y-%m-%d %H:%M})")
+
+    devices = {exif["device"] for _, exif in exif_data if exif["device"]}
+    if len(devices) > 1:
+        findings.append(f"Images were taken on {len(devices)} different devices ({', '.join(sorted(devices))})")
+
+    times = [exif["captured"] for _, exif in exif_data if exif["captured"]]
+    if len(times) > 1 and max(times) - min(times) > datetime.timedelta(days=MAX_CAPTURE_SPREAD_DAYS):
+        findings.append(f"Images were taken {(max(times) - min(times)).days} days apart")
+
+    return findings
+
+
+# Photographing a screen produces moire: strong isolated peaks in the high-frequency spectrum
+def moire_score(image, size=512):
+    gray = image.convert("L")
+    gray.thumbnail((size * 2, size * 2))
+    left = max(0, (gray.width - size) // 2)
+    top = max(0, (gray.height - size) // 2)
+    crop = np.asarray(gray.crop((left, top, left + size, top + size)), dtype=np.float32)
+    crop -= crop.mean()
+
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2(crop)))
+    h, w = spectrum.shape
+    yy, xx = np.ogrid[:h, :w]
+    radius = np.sqrt(((yy - h / 2) / (h / 2)) ** 2 + ((xx - w / 2) / (w / 2)) ** 2)
+    band = spectrum[(radius > 0.25) & (radius < 0.95)]
+    if band.size == 0:
+        return 0.0
+
+    peaks = np.sort(band)[-5:].mean()
+    return float(peaks / (np.median(band) + 1e-6))
+
+
+def check_screen_capture(name, image, exif):
+    findings = []
+    score = moire_score(image)
+    if score > MOIRE_THRESHOLD:
+        findings.append(f"{name} shows a moire pattern typical of a photographed screen (score {score:.0f})")
+    if not exif["device"] and exif["size"] in SCREEN_RESOLUTIONS:
+        width, height = exif["size"]
+        findings.append(f"{name} is exactly {width}x{height} with no camera metadata, likely a screenshot")
+    return findings
+
+
+# The ingest pool's prepared image, decoded at the size moire_score() works at
+def prepared_image(data, size=512):
+    image = Image.open(io.BytesIO(ingest.get_pool().prepared(data)[0]))
+    image.draft("RGB", (size * 2, size * 2))
+    return image
+
+
+# Registration as stored in the index, so "AB12 CDE" and "ab12cde" are the same vehicle
+def normalise_vehicle_reg(vehicle_reg):
+    return vehicle_reg.replace(" ", "").upper() if vehicle_reg else None
+
+
+# Run every local check on a claim's images and add them to the index.
+# A clear-cut duplicate of a photo from another claim sets skip_model so the model call can be skipped.
+# That includes an earlier claim on the same vehicle, re-using its photos is the same fraud; those
+# matches are flagged same_vehicle for the assessor.
+def prescreen_claim(claim_id, images, index=None, vehicle_reg=None):
+    if index is None:
+        index = open_index()
+    vehicle_reg = normalise_vehicle_reg(vehicle_reg)
+    findings = []
+    matches = []
+    exif_data = []
+    hashes = []
+
+    for i, image_input in enumerate(images):
+        name = getattr(image_input, "name", None) or (image_input if isinstance(image_input, str) else f"Image {i + 1}")
+        data = read_image_bytes(image_input)
+        # Only the header is read here, Image.open doesn't decode the pixels
+        exif = read_exif(Image.open(io.BytesIO(data)))
+        image = prepared_image(data)
+        exif_data.append((name, exif))
+
+        findings.extend(check_screen_capture(name, image, exif))
+
+        value = dhash(image)
+        hashes.append((name, value))
+        for match in index.search(value, NEAR_DUPLICATE_DISTANCE, exclude_claim_id=claim_id):
+            matches.append({"image": name, **match, "same_vehicle": bool(vehicle_reg) and match["vehicle_reg"] == vehicle_reg})
+
+    findings = check_exif(exif_data) + findings
+
+    # Only index after searching so a claim never matches its own photos
+    for name, value in hashes:
+        index.add(claim_id, name, value, vehicle_reg)
+
+    duplicates = [match for match in matches if match["distance"] <= DUPLICATE_DISTANCE]
+    if duplicates:
+        verdict = "fraudulent"
+    elif matches or findings:
+        verdict = "suspicious"
+    else:
+        verdict = "clear"
+
+    return {
+        "verdict": verdict,
+        "skip_model": bool(duplicates),
+        "findings": findings,
+        "matches": matches,
+    }
@@ -0,0 +1,165 @@
+import io
+import os
+import queue
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+# Image ingestion in worker processes.
+# Uploads are handed over as soon as they arrive, before "Process Images" is clicked. A worker
+# decodes each one, applies the EXIF orientation, shrinks it to what the vision model uses and
+# encodes the JPEG for the model along with a small preview for the sidebar. When the pipeline
+# starts it picks up the ready encodings, waits for any still in progress, and only prepares an
+# image itself if the image never made it into the pool.
+#
+# Backpressure: at most INGEST_QUEUE_DEPTH images wait for a worker. submit() refuses more, and the
+# caller prepares those on its own thread when it needs them.
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_QUEUE_DEPTH = int(os.environ.get("INGEST_QUEUE_DEPTH", "32"))
+# Prepared images kept in memory, least recently used go first
+INGEST_CACHE_SIZE = int(os.environ.get("INGEST_CACHE_SIZE", "128"))
+# The vision model scales anything larger down to fit 2048x2048, so sending more is wasted upload
+MAX_IMAGE_SIDE = int(os.environ.get("MAX_IMAGE_SIDE", "2048"))
+PREVIEW_SIDE = int(os.environ.get("PREVIEW_SIDE", "512"))
+
+
+def image_key(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _jpeg(image):
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+# Runs in the worker processes: original file bytes -> (JPEG for the model, preview JPEG)
+def prepare_image(data):
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip detail we'd throw away anyway, a big saving on 12-48 MP photos
+    image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    encoded = _jpeg(image)
+    image.thumbnail((PREVIEW_SIDE, PREVIEW_SIDE))
+    return encoded, _jpeg(image)
+
+
+class IngestPool:
+
+    def __init__(self, workers=INGEST_WORKERS, queue_depth=INGEST_QUEUE_DEPTH, cache_size=INGEST_CACHE_SIZE):
+        self.workers = workers
+        self.executor = self._new_executor()
+        self.intake = queue.Queue(maxsize=queue_depth)
+        # A couple of images per worker inside the process pool, the rest wait in the intake queue
+        self.in_flight = threading.BoundedSemaphore(workers * 2)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ready = OrderedDict()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def _new_executor(self):
+        # Spawned rather than forked, the app and service processes are full of threads
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # Queue an image for preparation. Returns False when the intake queue is full.
+    def submit(self, data):
+        key = image_key(data)
+        with self.lock:
+            if key in self.ready or key in self.pending:
+                return True
+            future = Future()
+            try:
+                self.intake.put_nowait((key, data, future))
+            except queue.Full:
+                return False
+            self.pending[key] = future
+        return True
+
+    def _dispatch(self):
+        while True:
+            key, data, future = self.intake.get()
+            self.in_flight.acquire()
+            try:
+                try:
+                    work = self.executor.submit(prepare_image, data)
+                except BrokenProcessPool:
+                    # A worker died, e.g. killed for running out of memory on a huge photo, and that breaks
+                    # the whole pool. Images it was preparing fail over to their callers, start a new pool
+                    # for the rest. Only this thread submits, so nothing else sees the old one.
+                    print("Image ingestion pool broke, starting a new one")
+                    self.executor.shutdown(wait=False)
+                    self.executor = self._new_executor()
+                    work = self.executor.submit(prepare_image, data)
+            except Exception as e:
+                # Callers fall back to preparing the image themselves
+                self.in_flight.release()
+                self._finish(key, future, None, e)
+                continue
+            work.add_done_callback(lambda work, key=key, future=future: self._worker_done(key, future, work))
+
+    def _worker_done(self, key, future, work):
+        self.in_flight.release()
+        error = work.exception()
+        self._finish(key, future, None if error else work.result(), error)
+
+    def _finish(self, key, future, prepared, error):
+        with self.lock:
+            self.pending.pop(key, None)
+            if error is None:
+                self._store(key, prepared)
+        if error is None:
+            future.set_result(prepared)
+        else:
+            future.set_exception(error)
+
+    def _store(self, key, prepared):
+        self.ready[key] = prepared
+        self.ready.move_to_end(key)
+        while len(self.ready) > self.cache_size:
+            self.ready.popitem(last=False)
+
+    # (JPEG for the model, preview JPEG) for the image: the ready encoding if there is one, waits if
+    # it's in progress, otherwise prepares it on the calling thread
+    def prepared(self, data):
+        key = image_key(data)
+        with self.lock:
+            if key in self.ready:
+                self.ready.move_to_end(key)
+                return self.ready[key]
+            future = self.pending.get(key)
+
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Image ingestion failed, preparing it here instead: {e}")
+
+        prepared = prepare_image(data)
+        with self.lock:
+            self._store(key, prepared)
+        return prepared
+
+    def stats(self):
+        with self.lock:
+            return {"workers": self.workers, "waiting": self.intake.qsize(), "pending": len(self.pending), "ready": len(self.ready)}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = IngestPool()
+        return _pool
@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+from backends import get_router, percentile
+
+# Load test harness for the Streamlit app.
+# Each ramp step starts a fresh app instance (one process, like a single Azure Web App worker)
+# and runs N concurrent simulated assessors through "Load Example" -> "Process Images", then asks
+# for the repair cost, drivability and triage so the latency covers the whole assessment.
+# The model and vehicle data endpoints are served by the local stand-ins in standins.py.
+# Every simulated claim gets its own FNOL text, so its own checkpoints, and every step its own
+# checkpoint store and fraud index, so no claim is served from another claim's checkpoints.
+# CPU and memory cover the instance process and the ingest pool workers it starts.
+#
+# The sessions are Streamlit AppTest sessions: they run the script in-process and skip the real server,
+# the websocket connections and sending the page to the browser. The saturation point measures the
+# script's own work (model calls, image handling, checkpoints) and is an upper bound for a deployed
+# instance, which also spends time on that delivery.
+#
+# Concurrent AppTest sessions need keep_test_runtime(), which replaces private Streamlit internals.
+# It was written against the Streamlit version pinned in requirements.txt, check it when upgrading.
+#
+# Usage:
+#   python loadtest.py --ramp 1,2,4,8,16,32 --claims-per-user 3
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+
+# This process and every process it started (the ingest pool's workers), from /proc
+def process_tree():
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    # The command name can hold spaces, the fields after it can't
+                    parents[int(entry)] = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+    tree = [os.getpid()]
+    for pid in tree:
+        tree.extend(child for child, parent in parents.items() if parent == pid)
+    return tree
+
+
+# Current resident set size of this process and its children in MB
+def current_rss_mb():
+    try:
+        total = 0
+        for pid in process_tree():
+            try:
+                with open(f"/proc/{pid}/statm") as statm:
+                    total += int(statm.read().split()[1])
+            except OSError:
+                # Exited since the tree was read
+                continue
+        return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # No procfs (e.g. macOS), fall back to the peak which is the best we have
+        return peak_rss_mb()
+
+
+# Peak resident set size in MB (ru_maxrss is KB on Linux): this process plus its largest child,
+# the samples of current_rss_mb() give the peak of the whole tree where procfs is available
+def peak_rss_mb():
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+# CPU seconds of this process and its children: the children still running are read from /proc,
+# the ones that have exited and been waited for are in RUSAGE_CHILDREN
+def cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    try:
+        children = process_tree()[1:]
+    except OSError:
+        return total
+    ticks = os.sysconf("SC_CLK_TCK")
+    for pid in children:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            # utime and stime, fields 14 and 15 of stat
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+# The stages that only run when the assessor asks for them, in the order an assessor would click them
+LAZY_STAGE_BUTTONS = ("Calculate Repair Cost", "Assess Drivability", "Triage and Allocate")
+
+
+def check_run(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    # Stage failures are shown in the page rather than raised
+    if at.error:
+        raise RuntimeError(at.error[0].value)
+
+
+# One simulated assessor: load the example claim, process it and complete every stage, claims_per_user times
+def simulate_user(user, claims_per_user, timeout, latencies, errors, lock):
+    from streamlit.testing.v1 import AppTest
+
+    for claim in range(claims_per_user):
+        try:
+            at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+            at.run()
+            next(b for b in at.sidebar.button if b.label == "Load Example").click()
+            at.run()
+            FNOL = at.sidebar.text_area[0]
+            FNOL.input(f"{FNOL.value} (load test user {user} claim {claim})")
+            at.run()
+
+            start = time.perf_counter()
+            next(b for b in at.sidebar.button if b.label == "Process Images").click()
+            at.run()
+            check_run(at)
+            for label in LAZY_STAGE_BUTTONS:
+                next(b for b in at.button if b.label == label).click()
+                at.run()
+                check_run(at)
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies.append(elapsed)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+
+
+# AppTest installs a mock Runtime for each run and removes it when the run ends. With concurrent
+# sessions in one process that pulls the runtime out from under scripts still running ("Runtime
+# hasn't been created!"), so once one has been installed keep handing out the latest.
+# This replaces Runtime.instance and Runtime.exists and reads Runtime._instance, so it stops with an
+# error if a Streamlit upgrade has changed them rather than measuring something else.
+def keep_test_runtime():
+    import streamlit
+    from streamlit.runtime import Runtime
+
+    if not (hasattr(Runtime, "_instance") and isinstance(Runtime.__dict__.get("instance"), classmethod)
+            and isinstance(Runtime.__dict__.get("exists"), classmethod)):
+        raise RuntimeError(f"Streamlit {streamlit.__version__} has changed the Runtime internals the load test relies on")
+
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+        if not latest:
+            raise RuntimeError("Runtime hasn't been created!")
+        return latest[0]
+
+    def exists(cls):
+        return cls._instance is not None or bool(latest)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+
+# Runs inside the instance subprocess: N concurrent sessions against one app process
+def run_instance(users, claims_per_user, timeout, result_file):
+    keep_test_runtime()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    rss_samples = []
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.is_set():
+            rss_samples.append(current_rss_mb())
+            done.wait(0.5)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    cpu_start = cpu_seconds()
+    wall_start = time.perf_counter()
+
+    threads = [
+        threading.Thread(target=simulate_user, args=(user, claims_per_user, timeout, latencies, errors, lock))
+        for user in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    wall = time.perf_counter() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    done.set()
+    sampler.join()
+
+    result = {
+        "users": users,
+        "claims": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": wall,
+        "throughput_per_min": len(latencies) / wall * 60 if wall else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "cpu_percent": cpu / wall * 100 if wall else 0.0,
+        "rss_mean_mb": sum(rss_samples) / len(rss_samples) if rss_samples else current_rss_mb(),
+        "rss_peak_mb": max(rss_samples + [peak_rss_mb()]),
+        # The app runs in this process, so the router has seen every model call of this step
+        "hedging": get_router().hedge_report(),
+    }
+    with open(result_file, "w") as f:
+        json.dump(result, f)
+
+
+# Start the stand-ins in their own process so their CPU isn't charged to the app instance
+def start_standins(port):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(APP_DIR, "standins.py"), "--port", str(port)],
+        cwd=APP_DIR,
+        stdout=subprocess.DEVNULL,
+    )
+    time.sleep(1)
+    return process
+
+
+def run_step(users, args):
+    with tempfile.TemporaryDirectory() as step_dir:
+        return run_instance_process(users, args, step_dir)
+
+
+def run_instance_process(users, args, step_dir):
+    result_file = os.path.join(step_dir, "result.json")
+
+    env = dict(os.environ)
+    # A fresh checkpoint store and fraud index per step, shared by the step's sessions
+    env["CHECKPOINT_PATH"] = os.path.join(step_dir, "checkpoints.sqlite3")
+    env["FRAUD_INDEX_PATH"] = os.path.join(step_dir, "fraud_index.sqlite3")
+    env["OPENAI_API_URL"] = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    env["VEHICLE_DATA_API_URL"] = f"http://127.0.0.1:{args.port}/vehicle-data"
+    env.setdefault("OPENAI_API_KEY", "standin")
+    env.setdefault("VEHICLE_DATA_API_KEY", "standin")
+
+    subprocess.run(
+        [sys.executable, __file__, "--instance",
+         "--users", str(users),
+         "--claims-per-user", str(args.claims_per_user),
+         "--timeout", str(args.timeout),
+         "--result-file", result_file],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+    with open(result_file) as f:
+        return json.load(f)
+
+
+# The saturation point is the first step where errors appear, p95 goes over the latency
+# objective, or adding users stops buying throughput. The first step can only saturate on the
+# first two, it has no previous step to gain on.
+def find_saturation(results, min_gain, p95_slo):
+    previous = None
+    for current in results:
+        if current["errors"]:
+            return current["users"], "errors"
+        if p95_slo and current["p95"] and current["p95"] > p95_slo:
+            return current["users"], f"p95 over {p95_slo:.0f}s"
+        if previous is not None and current["throughput_per_min"] < previous["throughput_per_min"] * (1 + min_gain):
+            return current["users"], f"throughput gain under {min_gain:.0%}"
+        previous = current
+    return None, None
+
+
+def format_seconds(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def print_report(results, saturation_users, reason):
+    print(f"{'users':>5} {'claims':>6} {'errors':>6} {'claims/min':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'cpu %':>6} {'rss MB':>7} {'peak MB':>7}")
+    for r in results:
+        print(
+            f"{r['users']:>5} {r['claims']:>6} {r['errors']:>6} {r['throughput_per_min']:>10.1f} "
+            f"{format_seconds(r['p50']):>7} {format_seconds(r['p95']):>7} {format_seconds(r['p99']):>7} "
+            f"{r['cpu_percent']:>6.0f} {r['rss_mean_mb']:>7.0f} {r['rss_peak_mb']:>7.0f}"
+        )
+        for sample in r["error_samples"]:
+            print(f"      error: {sample}")
+
+    hedged_steps = [r for r in results if r["hedging"]]
+    if hedged_steps:
+        print("")
+        print(f"{'users':>5} {'stage':<16} {'calls':>5} {'hedge %':>7} {'wins':>5} {'p95 s':>7} {'p95 no hedge':>12} {'p99 s':>7} {'p99 no hedge':>12}")
+        for r in hedged_steps:
+            for stage, h in r["hedging"].items():
+                print(
+                    f"{r['users']:>5} {stage:<16} {h['calls']:>5} {h['hedge_rate'] * 100:>7.1f} {h['hedge_wins']:>5} "
+                    f"{format_seconds(h['p95_served']):>7} {format_seconds(h['p95_primary']):>12} "
+                    f"{format_seconds(h['p99_served']):>7} {format_seconds(h['p99_primary']):>12}"
+                )
+
+    print("")
+    if saturation_users is None:
+        print(f"No saturation up to {results[-1]['users']} concurrent users per instance")
+    else:
+        sustainable = [r["users"] for r in results if r["users"] < saturation_users]
+        print(f"Saturation at {saturation_users} concurrent users per instance ({reason})")
+        if sustainable:
+            print(f"Size for at most {sustainable[-1]} concurrent assessors per instance")
+        else:
+            print("The first step already saturated the instance, ramp from fewer users")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Collision AI Streamlit app")
+    parser.add_argument("--ramp", default="1,2,4,8,16", help="Comma separated concurrent user counts")
+    parser.add_argument("--claims-per-user", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=600, help="Per-claim script timeout in seconds")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the local stand-ins")
+    parser.add_argument("--min-gain", type=float, default=0.10, help="Throughput gain below which the instance counts as saturated")
+    parser.add_argument("--p95-slo", type=float, default=None, help="p95 claim latency objective in seconds")
+    parser.add_argument("--output", help="Write the raw results to this JSON file")
+    # Internal: run as the app instance for a single ramp step
+    parser.add_argument("--instance", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.instance:
+        run_instance(args.users, args.claims_per_user, args.timeout, args.result_file)
+        sys.exit(0)
+
+    standins = start_standins(args.port)
+    results = []
+    try:
+        for users in [int(n) for n in args.ramp.split(",")]:
+            print(f"Running {users} concurrent users...", flush=True)
+            results.append(run_step(users, args))
+    finally:
+        standins.terminate()
+        standins.wait()
+
+    saturation_users, reason = find_saturation(results, args.min_gain, args.p95_slo)
+    print("")
+    print_report(results, saturation_users, reason)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "saturation_users": saturation_users, "reason": reason}, f, indent=2)
@@ -0,0 +1,108 @@
+import os
+import re
+import time
+import pstats
+import cProfile
+import contextlib
+
+# Opt-in profiling of Streamlit reruns. Set PROFILE_DIR to switch it on: every rerun of the script is
+# run under cProfile and dumped to PROFILE_DIR as <time>-<kind>-<claim id>.prof, where kind is
+# "process" for the rerun that processed a claim and "rerun" for everything else.
+# Open a dump with `python -m pstats <file>` or snakeviz.
+#
+# Only the script thread is profiled, background prefetch tasks don't show up.
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+# Rows shown in the hot spot table
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "15"))
+
+# Built-ins that block on the network, a lock or a sleep rather than doing local work
+WAIT_FUNCTIONS = re.compile(r"_socket\.|_ssl\.|select\.|time\.sleep|_thread\.lock|'acquire'|'wait'|getaddrinfo")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def enabled():
+    return bool(PROFILE_DIR)
+
+
+class ProfiledRun:
+    # Handed to the profiled block so it can say what the run turned out to be
+
+    def __init__(self):
+        self.kind = "rerun"
+        self.claim_id = None
+        self.path = None
+        self.summary = None
+
+
+def is_wait(function):
+    filename, _, name = function
+    return filename == "~" and bool(WAIT_FUNCTIONS.search(name))
+
+
+def describe(function):
+    filename, lineno, name = function
+    if filename == "~":
+        return name
+    if filename.startswith(APP_DIR):
+        filename = os.path.relpath(filename, APP_DIR)
+    else:
+        # Library code, the package and module are enough to place it
+        filename = "/".join(filename.split(os.sep)[-2:])
+    return f"{filename}:{lineno}({name})"
+
+
+# Total time, time spent waiting, the functions with the most own time once waits are left out,
+# and our own functions by cumulative time (which does include any waiting below them)
+def summarise(stats, top=PROFILE_TOP):
+    total = stats.total_tt
+    wait = 0.0
+    rows = []
+    for function, (_, calls, own, cumulative, _) in stats.stats.items():
+        if is_wait(function):
+            wait += own
+            continue
+        rows.append((function, {
+            "function": describe(function),
+            "calls": calls,
+            "own_seconds": round(own, 4),
+            "cumulative_seconds": round(cumulative, 4),
+        }))
+    hot_spots = sorted((row for _, row in rows), key=lambda row: row["own_seconds"], reverse=True)
+    ours = sorted(
+        (row for function, row in rows if function[0].startswith(APP_DIR)),
+        key=lambda row: row["cumulative_seconds"], reverse=True,
+    )
+    return {
+        "seconds": round(total, 3),
+        "wait_seconds": round(wait, 3),
+        "local_seconds": round(total - wait, 3),
+        "hot_spots": hot_spots[:top],
+        "our_functions": ours[:top],
+    }
+
+
+# Profile everything inside the block when profiling is on, does nothing otherwise.
+# on_done(run) is called once the profile is dumped, even when the block raised (st.rerun() does).
+@contextlib.contextmanager
+def profile_run(on_done=None):
+    run = ProfiledRun()
+    if not enabled():
+        yield run
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield run
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+        run.path = os.path.join(PROFILE_DIR, f"{stamp}-{run.kind}-{run.claim_id or 'no-claim'}.prof")
+        profiler.dump_stats(run.path)
+        run.summary = summarise(pstats.Stats(profiler))
+        if on_done is not None:
+            on_done(run)
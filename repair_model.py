@@ -0,0 +1,319 @@
+import sys
+import enum
+import base64
+import struct
+
+# Compact typed model of a parsed repair plan.
+# The model's JSON comes back as nested dicts of strings and booleans. Here each part is a small
+# slotted object with its position as an enum and its actions packed into one flag value, the
+# specialist work and wheels are single flag values, and part names are interned since the same
+# few dozen names turn up on every claim. A batch run can hold thousands of these for a fraction
+# of the memory of the dicts, and to_bytes()/from_bytes() store one in a few hundred bytes.
+# The checkpoints keep that form, as base64 text, rather than the model's JSON.
+
+
+class Position(enum.IntEnum):
+    NONE = 0
+    LH = 1
+    RH = 2
+    FRONT = 3
+    REAR = 4
+    LF = 5
+    RF = 6
+    LR = 7
+    RR = 8
+    # Anything else the model wrote, kept as text on the part
+    OTHER = 255
+
+
+class Action(enum.IntFlag):
+    STRIP_REFIT = 1
+    REPAIR = 2
+    REPLACE = 4
+    PAINT = 8
+
+
+# (flag, repair plan key, job card label) in job card order
+ACTIONS = (
+    (Action.STRIP_REFIT, "s_r", "Strip & Refit"),
+    (Action.REPAIR, "repair", "Repair"),
+    (Action.REPLACE, "replace", "Replace"),
+    (Action.PAINT, "paint", "Paint"),
+)
+
+
+# Same order as the specialist_work_required object in the repair plan example
+class Specialist(enum.IntFlag):
+    FIRST_DTC = 1
+    WHEEL_ALIGNMENT = 2
+    ROAD_TEST = 4
+    FINAL_DTC = 8
+    NEW_PART_CODING = 16
+    AIR_CON = 32
+    GLASS_REMOVAL = 64
+    ADAS_CALIBRATION = 128
+
+
+class Wheel(enum.IntFlag):
+    LF = 1
+    RF = 2
+    LR = 4
+    RR = 8
+
+
+# Lookup tables so rendering and loading never go through the (slow) enum and flag machinery per part
+_POSITIONS = {position.value: position for position in Position}
+# Positions as the model writes them, anything else (e.g. "Front") is kept as written
+_POSITION_NAMES = {position.name: position for position in Position if position not in (Position.NONE, Position.OTHER)}
+_POSITION_LABELS = {position: "" if position is Position.NONE else position.name for position in Position}
+_ACTION_FLAGS = {value: Action(value) for value in range(16)}
+_ACTION_LABELS = {value: [label for flag, _, label in ACTIONS if value & flag] for value in range(16)}
+_SPECIALIST_KEYS = [(flag.value, flag.name.lower(), flag.name.replace("_", " ").title()) for flag in Specialist]
+_WHEEL_NAMES = [(flag.value, flag.name) for flag in Wheel]
+
+FORMAT_VERSION = 2
+_HEADER = struct.Struct("<BHBBH")  # version, specialist flags, wheels listed, wheels removed, part count
+_PART = struct.Struct("<BB")  # position, action flags
+_LENGTH = struct.Struct("<I")
+
+
+def _pack_text(out, text):
+    encoded = text.encode("utf-8")
+    out += _LENGTH.pack(len(encoded))
+    out += encoded
+
+
+def _unpack_text(view, offset):
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    return str(view[offset:offset + length], "utf-8"), offset + length
+
+
+class Part:
+    __slots__ = ("name", "position", "actions", "position_text")
+
+    def __init__(self, name, position=Position.NONE, actions=Action(0), position_text=None):
+        self.name = sys.intern(name)
+        self.position = position
+        self.actions = actions
+        self.position_text = position_text
+
+    # Values are coerced to text, the model sometimes writes null or a number where a string belongs
+    @classmethod
+    def from_dict(cls, part):
+        text = str(part.get("position") or "")
+        position = _POSITION_NAMES.get(text, Position.OTHER) if text else Position.NONE
+        actions = Action(0)
+        for flag, key, _ in ACTIONS:
+            if part.get(key, False):
+                actions |= flag
+        return cls(str(part.get("part") or ""), position, actions, text if position is Position.OTHER else None)
+
+    # Position as written on the job card, empty when there isn't one
+    @property
+    def position_label(self):
+        if self.position is Position.OTHER:
+            return self.position_text
+        return _POSITION_LABELS[self.position]
+
+    def to_dict(self):
+        part = {"part": self.name, "position": self.position_label}
+        for flag, key, _ in ACTIONS:
+            part[key] = flag in self.actions
+        return part
+
+    def action_labels(self):
+        return _ACTION_LABELS[self.actions]
+
+
+class RepairPlan:
+    __slots__ = (
+        "reg_no", "damage_description", "parts", "new_parts_info", "specialist", "other_specialist",
+        "wheels_listed", "wheels_removed", "other_wheels", "smart_repairs_required",
+    )
+
+    def __init__(self, reg_no="", damage_description="", parts=(), new_parts_info="", specialist=Specialist(0),
+                 other_specialist=(), wheels_removed=Wheel(0), smart_repairs_required="", wheels_listed=Wheel(0),
+                 other_wheels=()):
+        self.reg_no = reg_no
+        self.damage_description = damage_description
+        self.parts = tuple(parts)
+        self.new_parts_info = new_parts_info
+        self.specialist = specialist
+        # Specialist operations set to true that aren't in the example, kept by name
+        self.other_specialist = tuple(other_specialist)
+        # The wheels the model gave, only those are on the job card
+        self.wheels_listed = wheels_listed
+        self.wheels_removed = wheels_removed
+        # (name, removed) for wheels the model named some other way, kept as written
+        self.other_wheels = tuple(other_wheels)
+        self.smart_repairs_required = smart_repairs_required
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError(f"Repair plan is a {type(data).__name__}, not a JSON object")
+        specialist = Specialist(0)
+        other_specialist = []
+        for key, value in (data.get("specialist_work_required") or {}).items():
+            if not value:
+                continue
+            flag = Specialist.__members__.get(key.upper())
+            if flag is None:
+                other_specialist.append(sys.intern(key))
+            else:
+                specialist |= flag
+
+        wheels_listed = Wheel(0)
+        wheels_removed = Wheel(0)
+        other_wheels = []
+        for wheel, removed in (data.get("wheels_removed_for_repair") or {}).items():
+            flag = Wheel.__members__.get(wheel)
+            if flag is None:
+                other_wheels.append((sys.intern(wheel), bool(removed)))
+                continue
+            wheels_listed |= flag
+            if removed:
+                wheels_removed |= flag
+
+        return cls(
+            str(data.get("reg_no") or ""),
+            str(data.get("damage_description") or ""),
+            [Part.from_dict(part) for part in data.get("parts_list") or []],
+            str(data.get("new_parts_info") or ""),
+            specialist,
+            other_specialist,
+            wheels_removed,
+            str(data.get("smart_repairs_required") or ""),
+            wheels_listed,
+            other_wheels,
+        )
+
+    # Names of the specialist operations required, as the repair plan keys
+    def specialist_keys(self):
+        specialist = int(self.specialist)
+        return [key for value, key, _ in _SPECIALIST_KEYS if specialist & value] + list(self.other_specialist)
+
+    def wheels_removed_names(self):
+        removed = int(self.wheels_removed)
+        return [name for value, name in _WHEEL_NAMES if removed & value] + [name for name, removed in self.other_wheels if removed]
+
+    # (name, removed) for every wheel the model gave
+    def wheels(self):
+        listed = int(self.wheels_listed)
+        removed = int(self.wheels_removed)
+        return [(name, bool(removed & value)) for value, name in _WHEEL_NAMES if listed & value] + list(self.other_wheels)
+
+    # Back to the repair plan JSON shape, for the API result and checkpoints
+    def to_dict(self):
+        specialist = {flag.name.lower(): flag in self.specialist for flag in Specialist}
+        specialist.update((key, True) for key in self.other_specialist)
+        return {
+            "reg_no": self.reg_no,
+            "damage_description": self.damage_description,
+            "parts_list": [part.to_dict() for part in self.parts],
+            "new_parts_info": self.new_parts_info,
+            "specialist_work_required": specialist,
+            "wheels_removed_for_repair": dict(self.wheels()),
+            "smart_repairs_required": self.smart_repairs_required,
+        }
+
+    def job_card(self):
+        lines = [
+            f"Digital Job Card for Vehicle: {self.reg_no}",
+            "",
+            f"Damage Description: {self.damage_description}",
+            "",
+            "Parts List:",
+        ]
+        for part in self.parts:
+            lines.append(f"  - {part.name} (Position: {part.position_label or 'N/A'}): {', '.join(part.action_labels())}")
+        lines += ["", "New Parts Info:", f"  {self.new_parts_info}", "", "Specialist Work Required:"]
+        specialist = int(self.specialist)
+        lines += [f"  - {title}" for value, _, title in _SPECIALIST_KEYS if specialist & value]
+        lines += [f"  - {key.replace('_', ' ').title()}" for key in self.other_specialist]
+        lines += ["", "Wheels Removed for Repair:"]
+        lines += [f"  - {name}: {'Removed' if removed else 'Not Removed'}" for name, removed in self.wheels()]
+        lines += ["", "Smart Repairs Required:", f"  {self.smart_repairs_required}"]
+        return "\n".join(lines)
+
+    # The plan as the later stages' prompts need it: everything the JSON says, without the JSON
+    def prompt_summary(self):
+        lines = [f"Vehicle: {self.reg_no or 'unknown'}", f"Damage: {self.damage_description}", "Parts:"]
+        for part in self.parts:
+            position = f"{part.position_label} " if part.position_label else ""
+            lines.append(f"- {position}{part.name}: {', '.join(part.action_labels()).lower() or 'inspect'}")
+        lines.append(f"New parts: {self.new_parts_info or 'none'}")
+        lines.append(f"Specialist work: {', '.join(key.replace('_', ' ') for key in self.specialist_keys()) or 'none'}")
+        lines.append(f"Wheels removed: {', '.join(self.wheels_removed_names()) or 'none'}")
+        lines.append(f"Smart repairs: {self.smart_repairs_required or 'none'}")
+        return "\n".join(lines)
+
+    def to_bytes(self):
+        out = bytearray(_HEADER.pack(FORMAT_VERSION, self.specialist, self.wheels_listed, self.wheels_removed, len(self.parts)))
+        for text in (self.reg_no, self.damage_description, self.new_parts_info, self.smart_repairs_required):
+            _pack_text(out, text)
+        out += _LENGTH.pack(len(self.other_specialist))
+        for key in self.other_specialist:
+            _pack_text(out, key)
+        out += _LENGTH.pack(len(self.other_wheels))
+        for name, removed in self.other_wheels:
+            _pack_text(out, name)
+            out.append(removed)
+        for part in self.parts:
+            out += _PART.pack(part.position, part.actions)
+            _pack_text(out, part.name)
+            if part.position is Position.OTHER:
+                _pack_text(out, part.position_text)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        view = memoryview(data)
+        version, specialist, wheels_listed, wheels_removed, part_count = _HEADER.unpack_from(view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported repair plan format version {version}")
+        offset = _HEADER.size
+
+        texts = []
+        for _ in range(4):
+            text, offset = _unpack_text(view, offset)
+            texts.append(text)
+        reg_no, damage_description, new_parts_info, smart_repairs_required = texts
+
+        (other_count,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        other_specialist = []
+        for _ in range(other_count):
+            key, offset = _unpack_text(view, offset)
+            other_specialist.append(sys.intern(key))
+
+        (other_count,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        other_wheels = []
+        for _ in range(other_count):
+            name, offset = _unpack_text(view, offset)
+            other_wheels.append((sys.intern(name), bool(view[offset])))
+            offset += 1
+
+        parts = []
+        for _ in range(part_count):
+            position, actions = _PART.unpack_from(view, offset)
+            offset += _PART.size
+            name, offset = _unpack_text(view, offset)
+            position = _POSITIONS[position]
+            position_text = None
+            if position is Position.OTHER:
+                position_text, offset = _unpack_text(view, offset)
+            parts.append(Part(name, position, _ACTION_FLAGS[actions], position_text))
+
+        return cls(reg_no, damage_description, parts, new_parts_info, Specialist(specialist),
+                   other_specialist, Wheel(wheels_removed), smart_repairs_required, Wheel(wheels_listed), other_wheels)
+
+    # to_bytes() as text, for JSON stores like the checkpoints
+    def to_base64(self):
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, text):
+        return cls.from_bytes(base64.b64decode(text.encode("ascii"), validate=True))
@@ -0,0 +1,456 @@
+import os
+import io
+import re
+import json
+import uuid
+import time
+import queue
+import shutil
+import socket
+import argparse
+import threading
+import traceback
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backends
+import checkpoints
+import fraud_screen
+import ingest
+import pipeline
+
+# HTTP assessment service so the claims management system can push claims without the Streamlit UI.
+#
+#   POST /claims                   multipart form: vehicle_reg, FNOL_description, images (repeatable)
+#                                  202 with the job id, 429 when the queue is full
+#   GET  /claims/<job_id>          job status and current stage
+#   GET  /claims/<job_id>/result   full JSON result once the job is done
+#   GET  /claims/<job_id>/job_card plain text job card once the job is done
+#   GET  /health
+#
+# A failed job records the stage that failed. Every stage before it is checkpointed under the claim ID
+# and FNOL (see checkpoints.py), so resubmitting the same claim resumes from that stage. A claim that got
+# through every stage is assessed afresh when resubmitted.
+#
+# Workers keep nothing between jobs. Job status, the submitted photos, results, the stage checkpoints
+# and the fraud index all live in JOB_STORE_DIR, so with a shared directory any replica behind the load
+# balancer can answer a poll for a job another replica accepted, resume a claim another replica left at
+# a failed stage, and catch photos re-used from a claim another replica assessed. Everything is kept as
+# plain files written with atomic renames and exclusive creates, which network filesystems support,
+# rather than SQLite, whose locking they don't. CHECKPOINT_DIR and FRAUD_INDEX_DIR move the checkpoints
+# and the index elsewhere, e.g. to share them with the Streamlit app.
+#
+# A worker holds a job through a claim file it renews while the job runs. Every replica regularly picks
+# up queued jobs nobody has claimed and running jobs whose claim has lapsed, so a job left behind by a
+# replica that restarted or died is run by another one.
+#
+# Point OPENAI_API_URL and VEHICLE_DATA_API_URL at standins.py to run it without outbound calls.
+
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "4"))
+SERVICE_QUEUE_DEPTH = int(os.environ.get("SERVICE_QUEUE_DEPTH", "16"))
+JOB_STORE_DIR = os.environ.get("JOB_STORE_DIR", "jobs")
+# Seconds a rejected client should wait before resubmitting
+RETRY_AFTER = int(os.environ.get("SERVICE_RETRY_AFTER", "30"))
+# Largest request body we accept, 20 phone photos fit comfortably
+MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", str(200 * 1024 * 1024)))
+# Seconds a worker's claim on a job lasts without being renewed, running jobs renew theirs every quarter of it
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+# Seconds between scans of the job store for jobs left behind
+JOB_RECOVERY_INTERVAL = float(os.environ.get("JOB_RECOVERY_INTERVAL", "60"))
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobStore:
+    # One JSON file per job, written atomically so readers never see a partial write.
+    # A job's photos are kept next to it until the job finishes, and a claim file marks the worker running it.
+
+    def __init__(self, directory=JOB_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoints = checkpoints.DirectoryCheckpointStore(checkpoints.CHECKPOINT_DIR or os.path.join(directory, "checkpoints"))
+        self.fraud_index = fraud_screen.DirectoryHashIndex(fraud_screen.FRAUD_INDEX_DIR or os.path.join(directory, "fraud_index"))
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _inputs_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.inputs")
+
+    def _claim_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.claim")
+
+    def job_ids(self):
+        return [name[:-len(".json")] for name in os.listdir(self.directory)
+                if name.endswith(".json") and JOB_ID_PATTERN.match(name[:-len(".json")])]
+
+    def save(self, job):
+        path = self._path(job["job_id"])
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, path)
+
+    def load(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, job_id):
+        os.remove(self._path(job_id))
+        self.delete_inputs(job_id)
+
+    def update(self, job_id, **changes):
+        job = self.load(job_id)
+        job.update(changes, updated_at=time.time())
+        self.save(job)
+        return job
+
+    # Saved before the job itself, so a job in the store always has its photos
+    def save_inputs(self, job_id, images):
+        directory = self._inputs_path(job_id)
+        os.makedirs(directory, exist_ok=True)
+        for i, image in enumerate(images):
+            with open(os.path.join(directory, f"{i:03d}"), "wb") as f:
+                f.write(image.getvalue())
+
+    # The job's photos as uploads, named as they were submitted
+    def load_inputs(self, job):
+        directory = self._inputs_path(job["job_id"])
+        images = []
+        for i, name in enumerate(job["image_names"]):
+            with open(os.path.join(directory, f"{i:03d}"), "rb") as f:
+                upload = io.BytesIO(f.read())
+            upload.name = name
+            images.append(upload)
+        return images
+
+    def delete_inputs(self, job_id):
+        shutil.rmtree(self._inputs_path(job_id), ignore_errors=True)
+
+    def _claim_lapsed(self, path, lease):
+        try:
+            return time.time() - os.stat(path).st_mtime > lease
+        except FileNotFoundError:
+            return True
+
+    def claimed(self, job_id, lease=JOB_LEASE_SECONDS):
+        return not self._claim_lapsed(self._claim_path(job_id), lease)
+
+    # Take the job for this worker. Returns False while another worker holds a claim it is still renewing.
+    def claim(self, job_id, owner, lease=JOB_LEASE_SECONDS):
+        path = self._claim_path(job_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._claim_lapsed(path, lease):
+                return False
+            # Its worker stopped renewing it. Move it aside first so only one replica takes the job over,
+            # and put it back if another replica renewed or replaced it in the meantime.
+            stale = f"{path}.{uuid.uuid4().hex}.stale"
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return False
+            if not self._claim_lapsed(stale, lease):
+                try:
+                    os.link(stale, path)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, "w") as f:
+            f.write(owner)
+        return True
+
+    def renew(self, job_id):
+        try:
+            os.utime(self._claim_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def release(self, job_id):
+        try:
+            os.remove(self._claim_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class WorkerPool:
+    # Fixed number of worker threads pulling job ids from a bounded queue.
+    # The pipeline spends nearly all its time waiting on the model, so threads are enough.
+
+    def __init__(self, store, workers=SERVICE_WORKERS, queue_depth=SERVICE_QUEUE_DEPTH,
+                 lease=JOB_LEASE_SECONDS, recovery_interval=JOB_RECOVERY_INTERVAL):
+        self.store = store
+        self.lease = lease
+        self.recovery_interval = recovery_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs = queue.Queue(maxsize=queue_depth)
+        self.lock = threading.Lock()
+        # Jobs waiting in this replica's queue, and the ones its workers hold a claim on
+        self.waiting = set()
+        self.running = set()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        self.threads.append(threading.Thread(target=self._renew_claims, daemon=True))
+        self.threads.append(threading.Thread(target=self._recover, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    # Returns False when the queue is full so the caller can apply backpressure
+    def submit(self, job_id):
+        with self.lock:
+            if job_id in self.waiting or job_id in self.running:
+                return True
+            try:
+                self.jobs.put_nowait(job_id)
+            except queue.Full:
+                return False
+            self.waiting.add(job_id)
+        return True
+
+    def _renew_claims(self):
+        while True:
+            time.sleep(self.lease / 4)
+            with self.lock:
+                running = list(self.running)
+            for job_id in running:
+                self.store.renew(job_id)
+
+    # Queue jobs left behind by a replica that stopped: queued for longer than a lease without anyone
+    # claiming them, or running with a claim that has lapsed. A worker that finds another replica got
+    # there first skips the job.
+    def _recover(self):
+        while True:
+            try:
+                for job_id in self.store.job_ids():
+                    job = self.store.load(job_id)
+                    if job is None or job["status"] not in ("queued", "running") or self.store.claimed(job_id, self.lease):
+                        continue
+                    if job["status"] == "queued" and time.time() - job["updated_at"] < self.lease:
+                        continue
+                    if not self.submit(job_id):
+                        break
+            except Exception:
+                traceback.print_exc()
+            time.sleep(self.recovery_interval)
+
+    def _work(self):
+        while True:
+            job_id = self.jobs.get()
+            with self.lock:
+                self.waiting.discard(job_id)
+            try:
+                if self.store.claim(job_id, self.owner, self.lease):
+                    with self.lock:
+                        self.running.add(job_id)
+                    try:
+                        self._run(job_id)
+                    finally:
+                        with self.lock:
+                            self.running.discard(job_id)
+                        self.store.release(job_id)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.jobs.task_done()
+
+    def _run(self, job_id):
+        job = self.store.load(job_id)
+        # Rejected, or finished by another worker before this one got the claim
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        try:
+            images = self.store.load_inputs(job)
+            # A job recovered from another replica's queue hasn't been through this replica's ingest pool yet
+            for image in images:
+                ingest.get_pool().submit(image.getvalue())
+            self.store.update(job_id, status="running", started_at=time.time())
+            result = pipeline.run_assessment(
+                job["vehicle_reg"],
+                job["FNOL_description"],
+                images,
+                claim_id=job["claim_id"],
+                on_stage=lambda stage: self.store.update(job_id, stage=stage),
+                store=self.store.checkpoints,
+                index=self.store.fraud_index,
+            )
+            self.store.update(job_id, status="done", stage=None, result=result, finished_at=time.time())
+        except checkpoints.StageFailed as e:
+            # Stages before this one are checkpointed, resubmitting the claim resumes here
+            traceback.print_exc()
+            self.store.update(job_id, status="failed", error=str(e), failed_stage=e.stage, finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            self.store.update(job_id, status="failed", error=str(e), finished_at=time.time())
+        self.store.delete_inputs(job_id)
+
+
+# Split a multipart/form-data body into text fields and uploaded files
+def parse_multipart(content_type, body):
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\nMIME-Version: 1.0\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        raise ValueError("Expected a multipart/form-data body")
+
+    fields = {}
+    files = []
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename:
+            upload = io.BytesIO(payload)
+            upload.name = filename
+            files.append(upload)
+        elif name:
+            fields[name] = payload.decode(part.get_content_charset() or "utf-8")
+    return fields, files
+
+
+class AssessmentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+    pool = None
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/claims":
+            self._send(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # There's no telling where the body ends, so don't read on from this connection
+            self.close_connection = True
+            self._send(400, {"error": "Content-Length must be a whole number of bytes"})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send(413, {"error": f"Request body larger than {MAX_BODY_BYTES} bytes"})
+            return
+
+        try:
+            fields, images = parse_multipart(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+
+        vehicle_reg = fields.get("vehicle_reg", "").strip()
+        FNOL_description = fields.get("FNOL_description", "").strip()
+        if not (vehicle_reg and FNOL_description and images):
+            self._send(400, {"error": "vehicle_reg, FNOL_description and at least one image are required"})
+            return
+
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "claim_id": pipeline.make_claim_id(vehicle_reg, images),
+            "vehicle_reg": vehicle_reg,
+            "FNOL_description": FNOL_description,
+            "image_count": len(images),
+            "image_names": [image.name for image in images],
+            "status": "queued",
+            "stage": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.save_inputs(job["job_id"], images)
+        self.store.save(job)
+
+        if not self.pool.submit(job["job_id"]):
+            self.store.delete(job["job_id"])
+            self._send(429, {"error": "Assessment queue is full, retry later"}, headers={"Retry-After": str(RETRY_AFTER)})
+            return
+
+        # Only for accepted jobs: start decoding and encoding the photos while the job waits in the queue
+        for image in images:
+            ingest.get_pool().submit(image.getvalue())
+
+        self._send(202, {
+            "job_id": job["job_id"],
+            "claim_id": job["claim_id"],
+            "status": "queued",
+            "status_url": f"/claims/{job['job_id']}",
+        }, headers={"Location": f"/claims/{job['job_id']}"})
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+
+        if parts == ["health"]:
+            self._send(200, {
+                "status": "ok",
+                "queued": self.pool.jobs.qsize(),
+                "queue_depth": self.pool.jobs.maxsize,
+                "hedging": backends.get_router().hedge_report(),
+                "resume_savings": self.store.checkpoints.savings(),
+            })
+            return
+
+        if len(parts) not in (2, 3) or parts[0] != "claims" or not JOB_ID_PATTERN.match(parts[1]):
+            self._send(404, {"error": "not found"})
+            return
+
+        job = self.store.load(parts[1])
+        if job is None:
+            self._send(404, {"error": "Unknown job"})
+            return
+
+        if len(parts) == 2:
+            self._send(200, {key: value for key, value in job.items() if key != "result"})
+            return
+
+        if job["status"] != "done":
+            self._send(409, {"error": f"Job is {job['status']}", "status": job["status"]})
+            return
+
+        if parts[2] == "result":
+            self._send(200, job["result"])
+        elif parts[2] == "job_card":
+            self._send(200, job["result"]["job_card"].encode("utf-8"), content_type="text/plain; charset=utf-8")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def serve(host="0.0.0.0", port=8000, workers=SERVICE_WORKERS, queue_depth=SERVICE_QUEUE_DEPTH, job_store_dir=JOB_STORE_DIR):
+    store = JobStore(job_store_dir)
+    handler = type("Handler", (AssessmentHandler,), {"store": store, "pool": WorkerPool(store, workers, queue_depth)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collision AI assessment service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--queue-depth", type=int, default=SERVICE_QUEUE_DEPTH)
+    parser.add_argument("--job-store", default=JOB_STORE_DIR)
+    args = parser.parse_args()
+
+    print(f"Assessment service listening on http://{args.host}:{args.port} with {args.workers} workers")
+    serve(args.host, args.port, args.workers, args.queue_depth, args.job_store).serve_forever()
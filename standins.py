@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the OpenAI chat completions endpoint and the vehicle data API.
+# Point the app at them with:
+#   OPENAI_API_URL=http://127.0.0.1:8765/v1/chat/completions
+#   VEHICLE_DATA_API_URL=http://127.0.0.1:8765/vehicle-data
+
+# Simulated model latency in seconds, vision calls are much slower than text-only calls
+VISION_LATENCY = float(os.environ.get("STANDIN_VISION_LATENCY", "2.0"))
+TEXT_LATENCY = float(os.environ.get("STANDIN_TEXT_LATENCY", "0.5"))
+LATENCY_JITTER = float(os.environ.get("STANDIN_LATENCY_JITTER", "0.25"))
+# A small share of calls straggle, like the real API's tail
+TAIL_PROBABILITY = float(os.environ.get("STANDIN_TAIL_PROBABILITY", "0.05"))
+TAIL_MULTIPLIER = float(os.environ.get("STANDIN_TAIL_MULTIPLIER", "5"))
+
+# Canned repair plan, same shape as the one-shot example in app.py
+REPAIR_PLAN = {
+    "reg_no": "WN17HLD",
+    "damage_description": "The images show a BMW 320D with heavy front end damage. The front bumper is broken and the bonnet is creased beyond repair limits. The airbags have deployed.",
+    "parts_list": [
+        {"part": "Front Bumper", "position": "FRONT", "s_r": True, "repair": False, "replace": True, "paint": True},
+        {"part": "Bonnet", "position": "", "s_r": True, "repair": False, "replace": True, "paint": True},
+        {"part": "Headlamp", "position": "RH", "s_r": True, "repair": False, "replace": True, "paint": False},
+        {"part": "Wing", "position": "RH", "s_r": True, "repair": True, "replace": False, "paint": True},
+        {"part": "Airbag", "position": "FRONT", "s_r": True, "repair": False, "replace": True, "paint": False}
+    ],
+    "new_parts_info": "Front Bumper, Bonnet, RH Headlamp, Airbags",
+    "specialist_work_required": {
+        "first_dtc": True,
+        "wheel_alignment": False,
+        "road_test": True,
+        "final_dtc": True,
+        "new_part_coding": True,
+        "air_con": False,
+        "glass_removal": False,
+        "adas_calibration": False
+    },
+    "wheels_removed_for_repair": {"LF": False, "RF": True, "LR": False, "RR": False},
+    "smart_repairs_required": "Check Radiator Support, Condenser and Radiator for damage."
+}
+
+# Canned vehicle data responses, same values as the pre-loaded ones in app.py
+VEHICLE_DATA = {
+    "ValuationData": {
+        "TradeRetail": 11210,
+        "StatusCode": "Success",
+        "Mileage": "82,225",
+        "PlateYear": "2017-17",
+        "VehicleDescription": "BMW 320D SPORT GT AUTO"
+    },
+    "VehicleData": {
+        "StatusCode": "Success",
+        "NumberOfDoors": 5,
+        "KerbWeight": 1595,
+        "Model": "320D SPORT GT AUTO",
+        "Make": "BMW",
+        "IsElectricVehicle": False,
+        "YearOfManufacture": "2017",
+        "Transmission": "AUTO 8 GEARS",
+        "FuelType": "DIESEL",
+        "BodyStyle": "Hatchback"
+    }
+}
+
+
+# Pick a canned answer for a prompt, matched on a phrase unique to each stage's system prompt
+def canned_answer(system_prompt, user_prompt):
+    if "located at the front or rear" in system_prompt:
+        return "Front"
+    if "best describes the location of the damage" in system_prompt:
+        return "Right Front"
+    if "images exist for both the front and rear" in system_prompt:
+        return "No"
+    if "switch 'Left' to 'Right'" in system_prompt:
+        return "Left Front"
+    if "basic fraud checks" in system_prompt:
+        return '{"fraudulent": false, "Description": "The images are of the correct vehicle and do not contain any watermarks or signs of tampering."}'
+    if "return valid json" in system_prompt:
+        # Echo back whatever json the previous stage produced
+        return user_prompt.split("Provide the raw json for the following:", 1)[-1].strip()
+    if "create a repair plan" in system_prompt:
+        return json.dumps(REPAIR_PLAN, indent=4)
+    if "overall cost of the repair" in system_prompt:
+        return "Adding up the parts and labour the overall cost of the repair is £6,412.50"
+    if "cost of the repair as a number" in system_prompt:
+        return "6412.50"
+    if "safe to drive" in system_prompt:
+        return '{"drivable": false, "reason": "The vehicle is not safe to drive due to the airbags being deployed."}'
+    if "spoke site, a hub site, or escalated" in system_prompt:
+        return "The repair cost is 57% of the vehicle value so it is within the total loss threshold. The airbags have deployed, so this vehicle should go to a Hub Site."
+    if "provide only the final decsion" in system_prompt:
+        return "Hub Site"
+    if "summarise the input" in system_prompt:
+        return "**Hub Site** - the repair cost is **57%** of the vehicle value and the airbags have deployed."
+    return "OK"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if not self.path.startswith("/v1/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        payload = json.loads(self._read_body())
+        system_prompt = ""
+        user_prompt = ""
+        has_images = False
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                text = content
+            else:
+                text = " ".join(item.get("text", "") for item in content if item.get("type") == "text")
+                has_images = has_images or any(item.get("type") == "image_url" for item in content)
+            if message.get("role") == "system":
+                system_prompt += text
+            else:
+                user_prompt += text
+
+        latency = VISION_LATENCY if has_images else TEXT_LATENCY
+        if random.random() < TAIL_PROBABILITY:
+            latency *= TAIL_MULTIPLIER
+        time.sleep(max(0.0, latency * random.uniform(1 - LATENCY_JITTER, 1 + LATENCY_JITTER)))
+
+        self._send_json(200, {
+            "id": "chatcmpl-standin",
+            "object": "chat.completion",
+            "model": payload.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": canned_answer(system_prompt, user_prompt)},
+                "finish_reason": "stop"
+            }]
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/vehicle-data":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        package = parse_qs(url.query).get("DataPackage", [""])[0]
+        if package not in VEHICLE_DATA:
+            self._send_json(404, {"StatusCode": "UnknownDataPackage"})
+            return
+        self._send_json(200, VEHICLE_DATA[package])
+
+    def log_message(self, format, *args):
+        # Keep load test output readable
+        pass
+
+
+def serve(host="127.0.0.1", port=8765):
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins for the model and vehicle data endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"Stand-ins listening on http://{args.host}:{args.port}")
+    serve(args.host, args.port).serve_forever()
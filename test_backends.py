@@ -0,0 +1,98 @@
+import json
+import time
+import base64
+import threading
+
+import pytest
+import requests
+
+import backends
+
+# Hedged requests against an in-process backend and the streamed request body, no network involved
+
+
+class SlowFirstBackend(backends.ChatBackend):
+    # The first request straggles, every later one answers at once
+
+    def __init__(self, name, settings):
+        super().__init__(name, settings)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def complete(self, model, messages, max_tokens, temperature=0, timeout=None):
+        with self.lock:
+            self.requests += 1
+            number = self.requests
+        if number == 1:
+            time.sleep(self.settings["straggle"])
+            return "primary"
+        return "hedge"
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setitem(backends.BACKEND_TYPES, "slow_first", SlowFirstBackend)
+    config = backends.load_routing_config()
+    config["endpoints"] = {"local": {"type": "slow_first", "straggle": 1.0}}
+    config["defaults"]["endpoint"] = "local"
+    config["stages"]["front_rear"].update(hedge=True, hedge_after=0.05)
+    return backends.ModelRouter(config)
+
+
+def test_hedge_beats_slow_primary(router):
+    start = time.perf_counter()
+    with backends.record_calls() as calls:
+        content = router.complete("front_rear", [], max_tokens=10)
+    seconds = time.perf_counter() - start
+
+    assert content == "hedge"
+    assert seconds < 0.5
+    assert router.backends["local"].requests == 2
+    assert calls[0]["reason"] == "hedged request won"
+
+    # Let the abandoned primary finish so its latency is in the report
+    time.sleep(1.1)
+    report = router.hedge_report()["front_rear"]
+    assert report["calls"] == 1
+    assert report["hedged"] == 1
+    assert report["hedge_wins"] == 1
+    assert report["p95_served"] < 0.5
+    assert report["p95_primary"] >= 1.0
+
+
+def test_fast_primary_sends_no_hedge(router):
+    router.backends["local"].requests = 1
+    assert router.complete("front_rear", [], max_tokens=10) == "hedge"
+    assert router.backends["local"].requests == 2
+    assert router.hedge_report()["front_rear"]["hedged"] == 0
+
+
+def vision_payload(jpeg):
+    return {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": "Réparer l'aile \"avant\" – 2× ✓"},
+            {"role": "user", "content": [
+                {"type": "text", "text": "Quote \"this\"\\n and\ttabs, éè and \U0001F697"},
+                {"type": "image_url", "image_url": {"url": backends.JpegDataUrl(jpeg)}},
+            ]},
+        ],
+        "max_tokens": 300,
+        "temperature": 0,
+    }
+
+
+# Sizes around the base64 padding, an image slice and the write buffer
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, backends.StreamingJSONBody.IMAGE_SLICE, backends.StreamingJSONBody.IMAGE_SLICE + 1, 200 * 1024 + 2])
+def test_streamed_body_is_the_json_payload(size):
+    jpeg = bytes(i % 251 for i in range(size))
+    body = backends.StreamingJSONBody(vision_payload(jpeg))
+    expected = vision_payload(jpeg)
+    expected["messages"][1]["content"][1]["image_url"]["url"] = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+
+    sent = b"".join(body)
+    assert sent == json.dumps(expected).encode("utf-8")
+    assert len(body) == len(sent)
+    # Iterating again sends the same bytes, as a retry or hedged request does
+    assert b"".join(body) == sent
+    assert requests.Request("POST", "http://127.0.0.1/", data=body).prepare().headers["Content-Length"] == str(len(sent))
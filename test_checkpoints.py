@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+import checkpoints
+
+# Both checkpoint stores behind ClaimCheckpoints
+
+
+@pytest.fixture(params=["sqlite", "directory"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return checkpoints.CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    return checkpoints.DirectoryCheckpointStore(str(tmp_path / "checkpoints"))
+
+
+def test_resumes_from_the_failed_stage(store):
+    claim = checkpoints.ClaimCheckpoints("AB12CDE-0123456789-abcdef0123", store)
+    assert claim.run("valuation", lambda: [11210, {"scale": 1.0}]) == [11210, {"scale": 1.0}]
+    with pytest.raises(checkpoints.StageFailed):
+        claim.run("location", lambda: {"error": "timed out"})
+
+    # Another worker, or another replica sharing the store, picks the claim up
+    resumed = checkpoints.ClaimCheckpoints("AB12CDE-0123456789-abcdef0123", store)
+    assert "valuation" in resumed and "location" not in resumed
+    assert resumed.run("valuation", lambda: pytest.fail("recomputed a checkpointed stage")) == [11210, {"scale": 1.0}]
+    assert resumed.run("location", lambda: "Front") == "Front"
+    assert resumed.saved()[0] == 1
+    assert store.savings()["valuation"]["resumes"] == 1
+
+    resumed.finish()
+    assert store.load("AB12CDE-0123456789-abcdef0123") == {}
+
+
+def test_claims_are_kept_apart(store):
+    store.save("claim-1", "location", "Front", 1, 0.5)
+    store.save("claim-2", "location", "Rear", 1, 0.5)
+    store.clear("claim-1")
+    assert store.load("claim-1") == {}
+    assert store.load("claim-2")["location"]["output"] == "Rear"
+
+
+def test_expired_checkpoints_are_not_loaded(store):
+    store.save("claim-1", "location", "Front", 1, 0.5)
+    store.ttl = 0
+    time.sleep(0.01)
+    assert store.load("claim-1") == {}
+
+
+def test_savings_add_up_across_processes(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    first = checkpoints.DirectoryCheckpointStore(directory)
+    second = checkpoints.DirectoryCheckpointStore(directory)
+    first.record_resume("location", 2, 1.5)
+    second.record_resume("location", 2, 1.25)
+    second.record_resume("fraud", 2, 4.0)
+    assert first.savings() == {
+        "fraud": {"resumes": 1, "model_calls": 2, "seconds": 4.0},
+        "location": {"resumes": 2, "model_calls": 4, "seconds": 2.75},
+    }
+    assert len(os.listdir(os.path.join(directory, "savings"))) == 2
@@ -0,0 +1,98 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+import fraud_screen
+import pipeline
+
+# The perceptual-hash index, in both its forms, and the pre-screen against a fresh index per test
+
+
+@pytest.fixture(params=["sqlite", "directory"])
+def index(request, tmp_path):
+    if request.param == "sqlite":
+        return fraud_screen.HashIndex(str(tmp_path / "fraud_index.sqlite3"))
+    return fraud_screen.DirectoryHashIndex(str(tmp_path / "fraud_index"))
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+BASE = random.Random(27).getrandbits(64)
+
+
+@pytest.mark.parametrize("bits", [
+    [],
+    [0],
+    [0, 1, 2, 3],
+    [0, 16, 32, 48],
+    # Every flip in one chunk, the other three still match exactly
+    list(range(10)),
+    # Spread so no chunk is exact, one is still within the radius
+    [0, 1, 2, 16, 17, 18, 32, 33, 48, 49],
+])
+def test_finds_hashes_within_the_distance(index, bits):
+    index.add("claim-1", "photo.jpg", flip(BASE, bits))
+    assert [match["distance"] for match in index.search(BASE)] == [len(bits)]
+
+
+def test_nothing_beyond_the_distance(index):
+    index.add("claim-1", "photo.jpg", flip(BASE, range(fraud_screen.NEAR_DUPLICATE_DISTANCE + 1)))
+    assert index.search(BASE) == []
+
+
+def test_matches_closest_first_and_skip_the_claim_itself(index):
+    index.add("claim-1", "a.jpg", flip(BASE, range(fraud_screen.DUPLICATE_DISTANCE + 1)))
+    index.add("claim-2", "b.jpg", flip(BASE, range(fraud_screen.DUPLICATE_DISTANCE)))
+    index.add("claim-3", "c.jpg", flip(BASE, range(fraud_screen.NEAR_DUPLICATE_DISTANCE)))
+
+    assert [(match["claim_id"], match["distance"]) for match in index.search(BASE)] == [
+        ("claim-2", fraud_screen.DUPLICATE_DISTANCE),
+        ("claim-1", fraud_screen.DUPLICATE_DISTANCE + 1),
+        ("claim-3", fraud_screen.NEAR_DUPLICATE_DISTANCE),
+    ]
+    assert [match["claim_id"] for match in index.search(BASE, exclude_claim_id="claim-2")] == ["claim-1", "claim-3"]
+
+
+def photo(seed, name="photo.jpg"):
+    pixels = random.Random(seed).randbytes(64 * 48 * 3)
+    buffered = io.BytesIO()
+    Image.frombytes("RGB", (64, 48), pixels).resize((640, 480)).save(buffered, format="JPEG")
+    buffered.name = name
+    return buffered
+
+
+def test_prescreen_flags_photos_from_another_claim(index):
+    first = fraud_screen.prescreen_claim("claim-1", [photo(1)], index, vehicle_reg="AB12 CDE")
+    assert first["matches"] == []
+    assert not first["skip_model"]
+
+    # Processing the same claim again doesn't match its own photos
+    assert fraud_screen.prescreen_claim("claim-1", [photo(1)], index, vehicle_reg="AB12 CDE")["matches"] == []
+
+    other_vehicle = fraud_screen.prescreen_claim("claim-2", [photo(1), photo(2, "new.jpg")], index, vehicle_reg="XY34 ZZZ")
+    assert [(match["image"], match["claim_id"], match["same_vehicle"]) for match in other_vehicle["matches"]] == [
+        ("photo.jpg", "claim-1", False),
+    ]
+    assert other_vehicle["verdict"] == "fraudulent"
+    assert other_vehicle["skip_model"]
+
+
+def test_prescreen_flags_old_photos_of_the_same_vehicle(index):
+    fraud_screen.prescreen_claim("claim-1", [photo(1)], index, vehicle_reg="AB12 CDE")
+    screened = fraud_screen.prescreen_claim("claim-2", [photo(1)], index, vehicle_reg="ab12cde")
+    assert [(match["claim_id"], match["same_vehicle"]) for match in screened["matches"]] == [("claim-1", True)]
+    assert screened["skip_model"]
+
+
+def test_correcting_the_fnol_keeps_the_claim_id():
+    images = [photo(1)]
+    assert pipeline.make_claim_id("AB12 CDE", images) == pipeline.make_claim_id("ab12cde", images)
+    assert pipeline.make_claim_id("AB12 CDE", images) != pipeline.make_claim_id("AB12 CDE", [photo(2)])
+    claim_id = pipeline.make_claim_id("AB12 CDE", images)
+    assert pipeline.checkpoint_key(claim_id, "Hit in the rear") != pipeline.checkpoint_key(claim_id, "Hit in the front")
@@ -0,0 +1,39 @@
+import io
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+
+import ingest
+
+# The ingest pool's worker processes
+
+
+def jpeg(colour):
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 48), colour).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def prepared_in_pool(pool, data):
+    assert pool.submit(data)
+    with pool.lock:
+        future = pool.pending.get(ingest.image_key(data))
+    # Raises if the pool failed it, where prepared() would quietly prepare it on this thread
+    return future.result(timeout=60) if future is not None else pool.ready[ingest.image_key(data)]
+
+
+def test_a_dead_worker_gets_a_new_pool():
+    pool = ingest.IngestPool(workers=1)
+    prepared_in_pool(pool, jpeg("red"))
+
+    # A worker that dies, as one killed for running out of memory would, breaks the whole pool
+    broken = pool.executor
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result(timeout=60)
+
+    encoded, preview = prepared_in_pool(pool, jpeg("blue"))
+    assert Image.open(io.BytesIO(encoded)).size == (64, 48)
+    assert pool.executor is not broken
+    pool.executor.shutdown()
@@ -0,0 +1,61 @@
+import copy
+
+import pytest
+
+import benchmark
+import repair_model
+import standins
+
+# The typed model against the repair plan JSON it is built from
+
+
+def plan_with(**changes):
+    data = copy.deepcopy(standins.REPAIR_PLAN)
+    data.update(changes)
+    return data
+
+
+def parts_with(**changes):
+    return [{**part, **changes} for part in standins.REPAIR_PLAN["parts_list"]]
+
+
+PLANS = [
+    standins.REPAIR_PLAN,
+    # Positions the model wrote its own way are shown as written
+    plan_with(parts_list=parts_with(position="Front")),
+    plan_with(parts_list=parts_with(position="front left")),
+    # Only the wheels the model gave
+    plan_with(wheels_removed_for_repair={"RF": True}),
+    plan_with(wheels_removed_for_repair={}),
+    plan_with(wheels_removed_for_repair={"LF": False, "RF": True, "Spare": True}),
+    plan_with(specialist_work_required={**standins.REPAIR_PLAN["specialist_work_required"], "bumper_sensor_check": True}),
+]
+
+
+@pytest.mark.parametrize("data", PLANS)
+def test_job_card_matches_the_old_builder(data):
+    assert repair_model.RepairPlan.from_dict(data).job_card() == benchmark.legacy_job_card(data)
+
+
+@pytest.mark.parametrize("data", PLANS)
+def test_round_trips(data):
+    plan = repair_model.RepairPlan.from_dict(data)
+    for loaded in (repair_model.RepairPlan.from_bytes(plan.to_bytes()), repair_model.RepairPlan.from_base64(plan.to_base64())):
+        assert loaded.to_dict() == plan.to_dict()
+        assert loaded.job_card() == plan.job_card()
+    assert repair_model.RepairPlan.from_dict(plan.to_dict()).to_dict() == plan.to_dict()
+
+
+def test_null_and_numeric_fields_are_text():
+    plan = repair_model.RepairPlan.from_dict(plan_with(
+        reg_no=None,
+        new_parts_info=None,
+        parts_list=[{"part": None, "position": 3, "replace": True}, {"part": "Wing", "position": None}],
+    ))
+    assert [(part.name, part.position_label) for part in plan.parts] == [("", "3"), ("Wing", "")]
+    assert "  -  (Position: 3): Replace" in plan.job_card()
+
+
+def test_a_plan_that_is_not_an_object_is_rejected():
+    with pytest.raises(ValueError):
+        repair_model.RepairPlan.from_dict(["Front Bumper"])
@@ -0,0 +1,100 @@
+import os
+import time
+import uuid
+import socket
+import threading
+
+import pytest
+
+import service
+
+# Job claims, recovery of jobs left behind, and request checks, against a job store in a temporary directory
+
+
+@pytest.fixture
+def store(tmp_path):
+    return service.JobStore(str(tmp_path / "jobs"))
+
+
+def make_job(store, status="queued", age=0):
+    now = time.time() - age
+    job = {"job_id": uuid.uuid4().hex, "status": status, "image_names": [], "created_at": now, "updated_at": now}
+    store.save(job)
+    return job["job_id"]
+
+
+# Backdate the claim as if its worker stopped renewing it that long ago
+def lapse_claim(store, job_id, seconds):
+    past = time.time() - seconds
+    os.utime(store._claim_path(job_id), (past, past))
+
+
+def test_one_worker_holds_a_claim(store):
+    job_id = make_job(store)
+    assert store.claim(job_id, "replica-a", lease=60)
+    assert not store.claim(job_id, "replica-b", lease=60)
+    assert store.claimed(job_id, lease=60)
+
+    store.release(job_id)
+    assert not store.claimed(job_id, lease=60)
+    assert store.claim(job_id, "replica-b", lease=60)
+
+
+def test_a_lapsed_claim_is_taken_over(store):
+    job_id = make_job(store, status="running")
+    assert store.claim(job_id, "replica-a", lease=60)
+    lapse_claim(store, job_id, 61)
+    assert not store.claimed(job_id, lease=60)
+
+    assert store.claim(job_id, "replica-b", lease=60)
+    assert not store.claim(job_id, "replica-c", lease=60)
+    with open(store._claim_path(job_id)) as f:
+        assert f.read() == "replica-b"
+
+
+def test_renewing_keeps_the_claim(store):
+    job_id = make_job(store, status="running")
+    assert store.claim(job_id, "replica-a", lease=60)
+    lapse_claim(store, job_id, 50)
+    store.renew(job_id)
+    assert store.claimed(job_id, lease=60)
+    assert not store.claim(job_id, "replica-b", lease=60)
+
+
+def test_recovers_jobs_left_behind(store):
+    abandoned_queued = make_job(store, age=120)
+    fresh_queued = make_job(store)
+    abandoned_running = make_job(store, status="running")
+    store.claim(abandoned_running, "replica-a", lease=60)
+    lapse_claim(store, abandoned_running, 61)
+    held_running = make_job(store, status="running")
+    store.claim(held_running, "replica-a", lease=60)
+    make_job(store, status="done", age=120)
+    make_job(store, status="failed", age=120)
+
+    # No workers, so whatever recovery queues stays in the queue to look at
+    pool = service.WorkerPool(store, workers=0, lease=60, recovery_interval=0.05)
+    deadline = time.time() + 5
+    while time.time() < deadline and len(pool.waiting) < 2:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    assert pool.waiting == {abandoned_queued, abandoned_running}
+    assert fresh_queued not in pool.waiting and held_running not in pool.waiting
+
+
+@pytest.fixture
+def server(store):
+    server = service.ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (service.AssessmentHandler,), {
+        "store": store, "pool": service.WorkerPool(store, workers=0),
+    }))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+
+
+@pytest.mark.parametrize("length", ["-1", "ten", "1.5"])
+def test_rejects_a_content_length_that_isnt_a_byte_count(server, length):
+    with socket.create_connection(server, timeout=5) as conn:
+        conn.sendall(f"POST /claims HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode("ascii"))
+        assert conn.recv(1024).startswith(b"HTTP/1.1 400")
@@ -0,0 +1,73 @@
+import pytest
+
+import repair_model
+import triage
+
+# Rule decisions for small repair plans against a £10,000 vehicle with the default config.
+# None means the claim is ambiguous and left to the model.
+
+
+def plan(*parts):
+    return repair_model.RepairPlan.from_dict({
+        "parts_list": [
+            {"part": name, "position": "", "replace": action == "replace", "repair": action == "repair"}
+            for name, action in parts
+        ],
+    })
+
+
+@pytest.mark.parametrize("parts, cost, decision", [
+    # Total loss rule
+    ([("Front Bumper", "replace")], "7000.00", triage.TOTAL_LOSS),
+    ([("Front Bumper", "replace")], "6200.00", None),
+    ([("Front Bumper", "replace")], "1000.00", triage.SPOKE_SITE),
+    # Hub parts, on any action or when replaced
+    ([("Airbag", "replace")], "1000.00", triage.HUB_SITE),
+    ([("Chassis Leg", "repair")], "1000.00", triage.HUB_SITE),
+    ([("Quarter Panel", "replace")], "1000.00", triage.HUB_SITE),
+    ([("Quarter Panel", "repair")], "1000.00", triage.SPOKE_SITE),
+    ([("Roof", "replace")], "1000.00", triage.HUB_SITE),
+    ([("Chassis Rail", "replace")], "1000.00", triage.HUB_SITE),
+    # Whole words only
+    ([("Trailer Hitch", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("Roofing Strip", "replace")], "1000.00", triage.SPOKE_SITE),
+    # Bolt-on parts and trim named after a hub part
+    ([("Tailgate Strut", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("Roof Rail", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("Engine Cover", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("Roof Lining", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("A Pillar Trim", "replace")], "1000.00", triage.SPOKE_SITE),
+    ([("Boot Floor Carpet", "replace")], "1000.00", triage.SPOKE_SITE),
+    # Parts that need a closer look
+    ([("Radiator", "replace")], "1000.00", None),
+    ([("Suspension Arm", "repair")], "1000.00", None),
+    # Excessively large repairs
+    ([(f"Panel {i}", "replace") for i in range(8)], "1000.00", triage.HUB_SITE),
+    ([(f"Panel {i}", "replace") for i in range(7)], "1000.00", triage.SPOKE_SITE),
+    # The cost has to be exactly one number
+    ([("Front Bumper", "replace")], "£1,000.00", triage.SPOKE_SITE),
+    ([("Front Bumper", "replace")], "The cost is for 2 parts: 5,000", None),
+    ([("Front Bumper", "replace")], "No cost given", None),
+    ([("Front Bumper", "replace")], {"error": "Stage 'cost' timed out after 60s"}, None),
+])
+def test_triage_claim(parts, cost, decision):
+    result = triage.triage_claim(plan(*parts), cost, 10000, config=triage.load_triage_config())
+    assert result["decision"] == decision
+    assert result["ambiguous"] == (decision is None)
+
+
+def test_electric_vehicle_battery_damage_goes_to_hub():
+    result = triage.triage_claim(plan(("Battery Pack", "repair")), "1000.00", 10000, is_electric=True)
+    assert result["decision"] == triage.HUB_SITE
+    assert triage.triage_claim(plan(("Battery Pack", "repair")), "1000.00", 10000)["decision"] == triage.SPOKE_SITE
+
+
+@pytest.mark.parametrize("cost, expected", [
+    ("1234.56", 1234.56),
+    ("£12,345.60", 12345.60),
+    (950, 950.0),
+    ("2 parts: 5,000", None),
+    ("", None),
+])
+def test_parse_cost(cost, expected):
+    assert triage.parse_cost(cost) == expected
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+
+import repair_model
+
+# Local triage engine.
+# Applies the total loss rule and the hub-site criteria directly to the structured repair plan,
+# and only leaves genuinely ambiguous claims for the model to reason about.
+#
+# Thresholds and part lists can be overridden with a JSON file pointed to by TRIAGE_CONFIG,
+# any keys missing from the file keep their defaults.
+
+DEFAULT_TRIAGE_CONFIG = {
+    # Repair cost as a fraction of trade retail at or above which the vehicle is a possible total loss
+    "total_loss_ratio": 0.60,
+    # Ratios this close to the total loss threshold are left to the model
+    "ambiguous_margin": 0.05,
+    # Number of replaced parts that makes it an excessively large repair
+    "large_repair_replacements": 8,
+    # Parts that send the vehicle to a hub whatever the action (deployed SRS, structural damage)
+    "hub_parts_any_action": [
+        "airbag", "seat belt", "pretensioner", "radiator support", "chassis", "structural rail",
+        "chassis leg", "boot floor",
+    ],
+    # Parts that send the vehicle to a hub when they need replacing (welded panels, suspension, drivetrain)
+    "hub_parts_replace": [
+        "quarter panel", "roof", "rail", "sill", "pillar", "suspension", "subframe", "strut",
+        "wishbone", "control arm", "steering rack", "drive shaft", "driveshaft", "engine", "gearbox", "transmission",
+    ],
+    # Bolt-on parts that share a word with the hub parts above (a tailgate strut isn't a suspension strut),
+    # these never send the vehicle to a hub or for review on the replace rule
+    "bolt_on_parts": [
+        "gas strut", "tailgate strut", "bonnet strut", "boot strut", "hood strut", "undertray", "spoiler",
+        "roof rail", "roof bar", "engine cover",
+    ],
+    # Interior and exterior trim named after the panel it covers (a roof lining isn't the roof),
+    # these never send the vehicle to a hub or for review whatever the action
+    "trim_parts": [
+        "trim", "moulding", "lining", "headlining", "liner", "carpet", "finisher", "scuff plate", "kick plate",
+        "sill cover",
+    ],
+    # Parts that send an electric vehicle to a hub (underside or high voltage damage)
+    "ev_hub_parts": ["battery", "underbody", "undertray", "high voltage", "charging"],
+    # Parts that need a closer look when they're on the plan but don't meet a hub rule on their own
+    "review_parts": ["suspension", "steering", "engine", "gearbox", "transmission", "radiator"],
+    # Specialist operations that can send the vehicle to a hub
+    "hub_specialist": [],
+    # Specialist operations that hint at hub-level damage not visible on the parts list
+    "review_specialist": ["wheel_alignment"],
+}
+
+TOTAL_LOSS = "Total Loss"
+HUB_SITE = "Hub Site"
+SPOKE_SITE = "Spoke Site"
+
+
+def load_triage_config(path=None):
+    path = path or os.environ.get("TRIAGE_CONFIG")
+    config = dict(DEFAULT_TRIAGE_CONFIG)
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
+
+
+# The cleaned cost from the model should be a bare number but may still carry £ or commas.
+# Anything that isn't exactly one number ("2 parts: 5,000") is None, the rules won't guess which one is the cost.
+def parse_cost(cost):
+    if isinstance(cost, (int, float)):
+        return float(cost)
+    # e.g. the {"error": ...} of a failed model call
+    if not isinstance(cost, str):
+        return None
+    numbers = re.findall(r"\d+(?:,\d{3})*(?:\.\d+)?", cost)
+    return float(numbers[0].replace(",", "")) if len(numbers) == 1 else None
+
+
+# The first keyword that appears in the part name as whole words (plurals included), so "rail" matches
+# "Chassis Rail" but not "Trailer Hitch"
+def _matches(part_name, keywords):
+    part_name = part_name.lower()
+    return next((keyword for keyword in keywords if re.search(rf"\b{re.escape(keyword)}s?\b", part_name)), None)
+
+
+# Hub reasons and review reasons from the parts list and specialist work of a repair_model.RepairPlan
+def evaluate_hub_criteria(plan, is_electric, config):
+    hub_reasons = []
+    review_reasons = []
+    replacements = 0
+
+    for part in plan.parts:
+        name = part.name
+        label = f"{part.position_label} {name}" if part.position_label else name
+        replaced = repair_model.Action.REPLACE in part.actions
+        actioned = replaced or repair_model.Action.REPAIR in part.actions
+        replacements += replaced
+        if _matches(name, config["trim_parts"]):
+            continue
+        bolt_on = _matches(name, config["bolt_on_parts"])
+
+        if actioned and _matches(name, config["hub_parts_any_action"]):
+            hub_reasons.append(f"{label} damaged")
+        elif replaced and not bolt_on and _matches(name, config["hub_parts_replace"]):
+            hub_reasons.append(f"{label} needs replacing")
+        elif is_electric and actioned and _matches(name, config["ev_hub_parts"]):
+            hub_reasons.append(f"{label} damaged on an electric vehicle")
+        elif actioned and not bolt_on and _matches(name, config["review_parts"]):
+            review_reasons.append(f"{label} needs {'replacing' if replaced else 'repairing'}")
+
+    if replacements >= config["large_repair_replacements"]:
+        hub_reasons.append(f"{replacements} parts need replacing")
+
+    for key in plan.specialist_keys():
+        if key in config["hub_specialist"]:
+            hub_reasons.append(f"{key.replace('_', ' ')} required")
+        elif key in config["review_specialist"]:
+            review_reasons.append(f"{key.replace('_', ' ')} required")
+
+    return hub_reasons, review_reasons
+
+
+def _summary(decision, cost, trade_retail, ratio, config, reasons):
+    threshold = f"{config['total_loss_ratio']:.0%}"
+    cost_line = f"The repair cost of £{cost:,.2f} is **{ratio:.0%}** of the £{trade_retail:,.0f} vehicle value"
+    if decision == TOTAL_LOSS:
+        return f"**{TOTAL_LOSS}** - {cost_line}, at or above the {threshold} total loss threshold."
+    if decision == HUB_SITE:
+        return f"**{HUB_SITE}** - {cost_line}, below the {threshold} total loss threshold. It needs a hub because: {'; '.join(reasons)}."
+    return f"**{SPOKE_SITE}** - {cost_line}, below the {threshold} total loss threshold, and none of the hub criteria apply."
+
+
+# Decide total loss / hub / spoke from the repair plan.
+# When the claim is ambiguous "decision" is None and the caller should fall back to the model.
+def triage_claim(plan, repair_cost, trade_retail, is_electric=False, config=None):
+    config = config or load_triage_config()
+    cost = parse_cost(repair_cost)
+    trade_retail = parse_cost(trade_retail)
+
+    result = {"decision": None, "ambiguous": True, "ratio": None, "reasons": [], "summary": ""}
+    if cost is None or not trade_retail:
+        result["reasons"] = ["repair cost or vehicle value missing or not a single number"]
+        return result
+
+    ratio = cost / trade_retail
+    result["ratio"] = ratio
+    hub_reasons, review_reasons = evaluate_hub_criteria(plan, is_electric, config)
+
+    if abs(ratio - config["total_loss_ratio"]) < config["ambiguous_margin"]:
+        result["reasons"] = [f"repair cost is {ratio:.0%} of the vehicle value, close to the total loss threshold"]
+        return result
+
+    if ratio >= config["total_loss_ratio"]:
+        decision = TOTAL_LOSS
+        reasons = [f"repair cost is {ratio:.0%} of the vehicle value"]
+    elif hub_reasons:
+        decision = HUB_SITE
+        reasons = hub_reasons
+    elif review_reasons:
+        result["reasons"] = review_reasons
+        return result
+    else:
+        decision = SPOKE_SITE
+        reasons = []
+
+    result.update({
+        "decision": decision,
+        "ambiguous": False,
+        "reasons": reasons,
+        "summary": _summary(decision, cost, trade_retail, ratio, config, reasons),
+    })
+    return result